@@ -0,0 +1,145 @@
+import math
+import time
+from abc import ABC
+from abc import abstractmethod
+from collections import OrderedDict
+
+from fastapi import Depends
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi.security import OAuth2PasswordRequestForm
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from starlette import status
+
+import settings
+from db.models import normalize_email
+
+LOGIN_ADMISSION_REJECTIONS = Counter(
+    "login_admission_rejections_total",
+    "Login attempts rejected before verifying the password",
+    ["reason"],
+)
+LOGIN_ADMISSION_IN_FLIGHT = Gauge(
+    "login_admission_in_flight",
+    "Login attempts admitted and not finished yet",
+)
+LOGIN_ADMISSION_LIMITS = Gauge(
+    "login_admission_limit",
+    "Configured limits of login admission control",
+    ["limit"],
+)
+
+
+class RateLimitStore(ABC):
+    """Token buckets by key, subclasses may keep them in a shared store"""
+
+    @abstractmethod
+    async def consume(self, key: str, capacity: float, refill_per_second: float):
+        """Takes a token from the bucket of key
+
+        Returns 0 when the token was taken, otherwise seconds until one is available.
+        """
+
+
+class InMemoryRateLimitStore(RateLimitStore):
+    """Buckets local to the worker process, least recently used ones are dropped"""
+
+    def __init__(self, max_keys: int) -> None:
+        self.max_keys = max_keys
+        # Key -> (tokens left, time of the last update)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def consume(self, key: str, capacity: float, refill_per_second: float):
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / refill_per_second
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        # Forgotten keys come back with a full bucket, so only idle ones go
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+class LoginAdmissionController:
+    """Rate limits login attempts and caps concurrent password verifications"""
+
+    def __init__(self, store: RateLimitStore) -> None:
+        self.store = store
+        self.in_flight = 0
+
+    async def check_rate(self, client_ip: str, email: str) -> None:
+        for reason, key, burst, per_minute in (
+            (
+                "ip_rate",
+                f"login:ip:{client_ip}",
+                settings.LOGIN_BURST_PER_IP,
+                settings.LOGIN_RATE_PER_IP_PER_MINUTE,
+            ),
+            (
+                "email_rate",
+                f"login:email:{normalize_email(email)}",
+                settings.LOGIN_BURST_PER_EMAIL,
+                settings.LOGIN_RATE_PER_EMAIL_PER_MINUTE,
+            ),
+        ):
+            retry_after = await self.store.consume(key, burst, per_minute / 60)
+            if retry_after:
+                LOGIN_ADMISSION_REJECTIONS.labels(reason=reason).inc()
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many login attempts",
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+
+    def acquire(self) -> None:
+        # Rejects right away, queued attempts would only add latency under load
+        if self.in_flight >= settings.LOGIN_MAX_CONCURRENT_VERIFICATIONS:
+            LOGIN_ADMISSION_REJECTIONS.labels(reason="concurrency").inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Login is temporarily overloaded",
+                headers={"Retry-After": str(settings.LOGIN_RETRY_AFTER_SECONDS)},
+            )
+        self.in_flight += 1
+        LOGIN_ADMISSION_IN_FLIGHT.inc()
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        LOGIN_ADMISSION_IN_FLIGHT.dec()
+
+
+login_admission = LoginAdmissionController(
+    InMemoryRateLimitStore(max_keys=settings.LOGIN_ADMISSION_MAX_KEYS)
+)
+
+for limit_name, limit_value in (
+    ("rate_per_ip_per_minute", settings.LOGIN_RATE_PER_IP_PER_MINUTE),
+    ("burst_per_ip", settings.LOGIN_BURST_PER_IP),
+    ("rate_per_email_per_minute", settings.LOGIN_RATE_PER_EMAIL_PER_MINUTE),
+    ("burst_per_email", settings.LOGIN_BURST_PER_EMAIL),
+    ("max_concurrent_verifications", settings.LOGIN_MAX_CONCURRENT_VERIFICATIONS),
+):
+    LOGIN_ADMISSION_LIMITS.labels(limit=limit_name).set(limit_value)
+
+
+async def admit_login(
+    request: Request, form_data: OAuth2PasswordRequestForm = Depends()
+):
+    """Dependency admitting a login attempt before its password is verified"""
+    client_ip = request.client.host if request.client else "unknown"
+    await login_admission.check_rate(client_ip, form_data.username)
+    login_admission.acquire()
+    try:
+        yield
+    finally:
+        login_admission.release()
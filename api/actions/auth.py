@@ -1,68 +1,201 @@
 import json
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
 from typing import Optional
 from uuid import UUID
 
 from fastapi import Depends
 from fastapi import HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt
 from jose import JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 import settings
+from db.dals import principal_cache
+from db.dals import RefreshTokenDAL
 from db.dals import UserDAL
-from db.models import User
+from db.models import decode_roles
+from db.models import encode_roles
+from db.models import PortalRoleMixin
+from db.models import UserRecord
 from db.session import get_db
-from hashing import Hasher
+from hashing import AsyncHasher
+from security import create_refresh_token
+from security import decode_access_token
+from security import hash_refresh_token
+from security import UUIDEncoder
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login/token")
 
 
-async def _get_user_by_email_for_auth(email, session: AsyncSession):
-    async with session.begin():
-        user_dal = UserDAL(session)
-        return await user_dal.get_user_by_email(
-            email=email,
+class TokenPrincipal(PortalRoleMixin):
+    """Authenticated user rebuilt from stateless token claims, without a DB lookup"""
+
+    __slots__ = ("user_id", "roles", "is_active", "security_version")
+
+    def __init__(
+        self, user_id: UUID, roles: int, is_active: bool, security_version: int
+    ) -> None:
+        self.user_id = user_id
+        self.roles = roles
+        self.is_active = is_active
+        self.security_version = security_version
+
+
+def build_access_token_claims(user: UserRecord) -> dict:
+    """Claims for a new access token, with authorization data when enabled"""
+    claims = {"sub": json.dumps(user.user_id, cls=UUIDEncoder)}
+    if settings.STATELESS_AUTH_TOKENS:
+        claims.update(
+            {
+                "roles": decode_roles(user.roles),
+                "active": user.is_active,
+                "ver": user.security_version,
+            }
         )
+    return claims
+
+
+async def _get_user_by_email_for_auth(email, session: AsyncSession):
+    user_dal = UserDAL(session)
+    return await user_dal.get_user_with_password_by_email(
+        email=email,
+    )
 
 
 async def _get_user_by_id_for_auth(user_id, session: AsyncSession):
-    async with session.begin():
-        user_dal = UserDAL(session)
-        return await user_dal.get_user_by_id(
-            user_id=user_id,
-        )
+    user = principal_cache.get(user_id)
+    if user is not None:
+        return user
+    user_dal = UserDAL(session)
+    user = await user_dal.get_user_by_id(
+        user_id=user_id,
+    )
+    if user is not None:
+        principal_cache.set(user_id, user)
+    return user
+
+
+async def _issue_refresh_token(user_id: UUID, session: AsyncSession) -> str:
+    refresh_token, token_hash = create_refresh_token()
+    refresh_token_dal = RefreshTokenDAL(session)
+    await refresh_token_dal.create_refresh_token(
+        user_id=user_id,
+        token_hash=token_hash,
+        expires_at=datetime.now(timezone.utc)
+        + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
+        commit=True,
+    )
+    return refresh_token
+
+
+async def _rotate_refresh_token(refresh_token: str, session: AsyncSession):
+    """Exchanges refresh token for a new one, returned with its user's row
+
+    Both are None when the token is unknown, expired, used or revoked.
+    """
+    new_refresh_token, new_token_hash = create_refresh_token()
+    refresh_token_dal = RefreshTokenDAL(session)
+    user = await refresh_token_dal.rotate_refresh_token(
+        token_hash=hash_refresh_token(refresh_token)
+    )
+    if user is None:
+        return None, None
+    await refresh_token_dal.create_refresh_token(
+        user_id=user.user_id,
+        token_hash=new_token_hash,
+        expires_at=datetime.now(timezone.utc)
+        + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
+        commit=True,
+    )
+    return new_refresh_token, user
+
+
+async def _revoke_refresh_token(refresh_token: str, session: AsyncSession) -> bool:
+    refresh_token_dal = RefreshTokenDAL(session)
+    revoked = await refresh_token_dal.revoke_refresh_token(
+        token_hash=hash_refresh_token(refresh_token)
+    )
+    await session.commit()
+    return revoked
 
 
 async def authenticate_user(
     email, password: str, session: AsyncSession
-) -> Optional[User]:
-    user = await _get_user_by_email_for_auth(email=email, session=session)
-    if user is None:
+) -> Optional[UserRecord]:
+    user_row = await _get_user_by_email_for_auth(email=email, session=session)
+    # Ends the read so no pooled connection is held while the password is hashed
+    await session.commit()
+    if user_row is None:
         return
-    if not Hasher.verify_password(password, user.hashed_password):
+    user, hashed_password = user_row
+    is_verified, new_hashed_password = await AsyncHasher.verify_and_update(
+        password, hashed_password
+    )
+    if not is_verified:
         return
+    # Moves the hash to the current scheme and cost while the password is known
+    # Committed together with the rest of the login request
+    if new_hashed_password is not None:
+        user_dal = UserDAL(session)
+        await user_dal.update_password(
+            user_id=user.user_id, hashed_password=new_hashed_password
+        )
     return user
 
 
-async def get_current_user_from_token(
-    token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_db)
-):
+def _decode_token_claims(token: str) -> tuple[UUID, dict]:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
     )
     try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
-        user_id: UUID = json.loads(payload.get("sub"))
-        if user_id is None:
+        payload = decode_access_token(token)
+        sub = payload.get("sub")
+        if sub is None:
             raise credentials_exception
-    except JWTError:
+        # UUID instances keep cache keys consistent with the ones DAL invalidates
+        user_id = UUID(json.loads(sub))
+    except (JWTError, ValueError):
         raise credentials_exception
+    return user_id, payload
+
+
+async def get_current_user_from_token(
+    token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_db)
+):
+    """Dependency loading the authenticated user, meant for write endpoints"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+    )
+    user_id, payload = _decode_token_claims(token)
     user = await _get_user_by_id_for_auth(user_id=user_id, session=session)
-    if user is None:
+    if user is None or not user.is_active:
+        raise credentials_exception
+    # Roles or status changed since the stateless token was issued
+    if "ver" in payload and payload["ver"] != user.security_version:
         raise credentials_exception
     return user
+
+
+async def get_current_principal_from_token(
+    token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_db)
+):
+    """Dependency for read endpoints, trusts stateless tokens without a DB lookup"""
+    user_id, payload = _decode_token_claims(token)
+    if "ver" not in payload:
+        return await get_current_user_from_token(token=token, session=session)
+    if not payload.get("active"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+        )
+    return TokenPrincipal(
+        user_id=user_id,
+        roles=encode_roles(payload.get("roles", [])),
+        is_active=True,
+        security_version=payload["ver"],
+    )
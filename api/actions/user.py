@@ -1,3 +1,6 @@
+import base64
+import binascii
+import json
 from typing import Optional
 from uuid import UUID
 
@@ -6,90 +9,125 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.schemas import ShowUser
 from api.schemas import UserCreate
+from api.schemas import UserListOrder
+from api.schemas import UserListResponse
+from db.dals import AdminPrivilegeAction
 from db.dals import PortalRole
 from db.dals import UserDAL
-from db.models import User
-from hashing import Hasher
+from db.dals import WriteOutcome
+from db.models import UserRecord
+from hashing import AsyncHasher
 
 
 async def _create_new_user(body: UserCreate, session) -> ShowUser:
     """Handler for creating new user"""
-    async with session.begin():
-        user_dal = UserDAL(session)
-        user = await user_dal.create_user(
-            name=body.name,
-            surname=body.surname,
-            email=body.email,
-            hashed_password=Hasher.get_password_hash(body.password),
-            roles=[
-                PortalRole.ROLE_PORTAL_USER,
-            ],
-        )
-        return ShowUser(
-            user_id=user.user_id,
-            name=user.name,
-            surname=user.surname,
-            email=user.email,
-            is_active=user.is_active,
-        )
-
-
-async def _delete_user(user_id, session: AsyncSession) -> Optional[UUID]:
-    """Handler for deleting existing user"""
-
-    async with session.begin():
-        user_dal = UserDAL(session)
-        deleted_user_id = await user_dal.delete_user(user_id=user_id)
-        return deleted_user_id
-
-
-# Handler for updating existing user
-async def _update_user(
-    updated_user_params: dict, user_id: UUID, session: AsyncSession
-) -> Optional[UUID]:
-    """Handler for updating existing user"""
-    async with session.begin():
-        user_dal = UserDAL(session)
-        updated_user_id = await user_dal.update_user(
-            user_id=user_id, **updated_user_params
-        )
-        return updated_user_id
+    # Hashing before the transaction starts keeps it short
+    hashed_password = await AsyncHasher.get_password_hash(body.password)
+    user_dal = UserDAL(session)
+    user = await user_dal.create_user(
+        name=body.name,
+        surname=body.surname,
+        email=body.email,
+        hashed_password=hashed_password,
+        roles=[
+            PortalRole.ROLE_PORTAL_USER,
+        ],
+    )
+    await session.commit()
+    return ShowUser(
+        user_id=user.user_id,
+        name=user.name,
+        surname=user.surname,
+        email=user.email,
+        is_active=user.is_active,
+    )
+
+
+async def _delete_user(
+    user_id: UUID, current_user: UserRecord, session: AsyncSession
+) -> WriteOutcome:
+    """Handler for deleting existing user, revoking its refresh tokens"""
+    user_dal = UserDAL(session)
+    outcome = await user_dal.delete_user_if_permitted(
+        user_id=user_id, current_user=current_user, commit=True
+    )
+    return outcome
+
+
+async def _update_user_if_permitted(
+    updated_user_params: dict,
+    user_id: UUID,
+    current_user: UserRecord,
+    session: AsyncSession,
+) -> WriteOutcome:
+    """Handler for updating existing user on behalf of the current user"""
+    user_dal = UserDAL(session)
+    outcome = await user_dal.update_user_if_permitted(
+        user_id=user_id,
+        current_user=current_user,
+        commit=True,
+        **updated_user_params,
+    )
+    return outcome
+
+
+async def _change_admin_privilege(
+    user_ids: list[UUID], action: AdminPrivilegeAction, session: AsyncSession
+) -> dict[UUID, WriteOutcome]:
+    """Handler for granting or revoking admin privileges of users at once"""
+    user_dal = UserDAL(session)
+    return await user_dal.change_admin_privilege(
+        user_ids=user_ids, action=action, commit=True
+    )
 
 
 # Handler for creating new user
-async def _get_user_by_id(user_id, session) -> Optional[User]:
+async def _get_user_by_id(user_id, session) -> Optional[UserRecord]:
     """Handler for getting existing user info by id"""
-    async with session.begin():
-        user_dal = UserDAL(session)
-        user = await user_dal.get_user_by_id(
-            user_id=user_id,
-        )
-        if user is not None:
-            return user
-
-
-def check_user_permissions(target_user: User, current_user: User) -> bool:
-    if PortalRole.ROLE_PORTAL_SUPERADMIN in current_user.roles:
-        raise HTTPException(
-            status_code=406, detail="Superadmin cannot be deleted via API"
-        )
-    if target_user.user_id != current_user.user_id:
-        # Check admin role
-        if not {
-            PortalRole.ROLE_PORTAL_ADMIN,
-            PortalRole.ROLE_PORTAL_SUPERADMIN,
-        }.intersection(current_user.roles):
-            return False
-        # Check admin deactivate super-admin attempt
-        if (
-            PortalRole.ROLE_PORTAL_SUPERADMIN in target_user.roles
-            and PortalRole.ROLE_PORTAL_ADMIN in current_user.roles
-        ):
-            return False
-        # Check admin deactivate admin attempt
-        if (
-            PortalRole.ROLE_PORTAL_ADMIN in target_user.roles
-            and PortalRole.ROLE_PORTAL_ADMIN in current_user.roles
-        ):
-            return False
-    return True
+    user_dal = UserDAL(session)
+    user = await user_dal.get_user_by_id(
+        user_id=user_id,
+    )
+    if user is not None:
+        return user
+
+
+def _encode_cursor(order_by: UserListOrder, last_key) -> str:
+    cursor = json.dumps({"order_by": order_by, "after": str(last_key)})
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def _decode_cursor(order_by: UserListOrder, cursor: str):
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if decoded["order_by"] != order_by:
+            raise ValueError("Cursor of another order")
+        if order_by == UserListOrder.USER_ID:
+            return UUID(decoded["after"])
+        return str(decoded["after"])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+async def _list_users(
+    order_by: UserListOrder,
+    cursor: Optional[str],
+    limit: int,
+    session: AsyncSession,
+    **filters,
+) -> UserListResponse:
+    """Handler for listing users page by page, the cursor holds the last key"""
+    after = _decode_cursor(order_by, cursor) if cursor is not None else None
+    user_dal = UserDAL(session)
+    # One extra row tells whether there is a next page
+    users = await user_dal.list_users(
+        order_by=order_by, after=after, limit=limit + 1, **filters
+    )
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = _encode_cursor(order_by, getattr(users[-1], order_by))
+    return UserListResponse(
+        users=[ShowUser.model_validate(user) for user in users],
+        next_cursor=next_cursor,
+    )
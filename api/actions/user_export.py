@@ -0,0 +1,56 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.dals import UserDAL
+from db.models import decode_roles
+
+EXPORT_COLUMNS = ["user_id", "name", "surname", "email", "is_active", "roles"]
+
+
+def _ndjson_chunk(rows) -> str:
+    return "".join(
+        json.dumps(
+            {**dict(zip(EXPORT_COLUMNS, row)), "roles": decode_roles(row[-1])},
+            default=str,
+        )
+        + "\n"
+        for row in rows
+    )
+
+
+def _csv_chunk(rows) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(
+        (user_id, name, surname, email, is_active, ";".join(decode_roles(roles)))
+        for user_id, name, surname, email, is_active, roles in rows
+    )
+    return buffer.getvalue()
+
+
+def _csv_header() -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_COLUMNS)
+    return buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", _ndjson_chunk),
+    "csv": ("text/csv", _csv_chunk),
+}
+
+
+async def _export_users(
+    export_format: str, session: AsyncSession
+) -> AsyncIterator[str]:
+    """Serializes users fetched partition by partition from a server-side cursor"""
+    _, serialize = EXPORT_FORMATS[export_format]
+    if export_format == "csv":
+        yield _csv_header()
+    user_dal = UserDAL(session)
+    async for rows in user_dal.stream_users(EXPORT_COLUMNS):
+        yield serialize(rows)
@@ -0,0 +1,225 @@
+import asyncio
+import csv
+import json
+from typing import AsyncIterator
+from typing import Callable
+from typing import Optional
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import StreamingResponse
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+import settings
+from api.schemas import ImportedUserResult
+from api.schemas import ImportStatus
+from api.schemas import UserCreate
+from db.dals import PortalRole
+from db.dals import UserDAL
+from db.models import encode_roles
+from db.models import uuid7
+from hashing import AsyncHasher
+from hashing import HashingUnavailableError
+
+
+class ImportResultsResponse(StreamingResponse):
+    """Streams results while the upload they come from is still being read
+
+    StreamingResponse listens for the disconnect message concurrently, which
+    would consume the request body chunks, so this one only streams.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Optional[str]]:
+    """Splits a byte stream into lines, holding no more than one of them
+
+    Lines longer than the limit are dropped and yielded as None.
+    """
+    max_bytes = settings.USER_IMPORT_MAX_LINE_BYTES
+    buffer, too_long = b"", False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            too_long = too_long or len(line) > max_bytes
+            yield None if too_long else line.decode(errors="replace")
+            too_long = False
+        if len(buffer) > max_bytes:
+            buffer, too_long = b"", True
+    if buffer or too_long:
+        yield None if too_long else buffer.decode(errors="replace")
+
+
+def _parse_ndjson_row(line: str, header: Optional[list[str]]) -> dict:
+    row = json.loads(line)
+    if not isinstance(row, dict):
+        raise ValueError("Row should be a JSON object")
+    return row
+
+
+def _split_csv_line(line: str) -> list[str]:
+    # Lines are parsed one at a time, so a quoted field cannot span several
+    if line.count('"') % 2:
+        raise ValueError("Quoted fields should not contain line breaks")
+    return next(csv.reader([line]))
+
+
+def _parse_csv_row(line: str, header: Optional[list[str]]) -> dict:
+    values = _split_csv_line(line)
+    if len(values) != len(header):
+        raise ValueError(f"Row should have {len(header)} fields")
+    return dict(zip(header, values))
+
+
+ROW_PARSERS: dict[str, Callable[[str, Optional[list[str]]], dict]] = {
+    "application/x-ndjson": _parse_ndjson_row,
+    "text/csv": _parse_csv_row,
+}
+
+
+def _validate_row(parse_row, line: str, header: Optional[list[str]]) -> UserCreate:
+    try:
+        return UserCreate(**parse_row(line, header))
+    except ValidationError as err:
+        raise ValueError("; ".join(error["msg"] for error in err.errors()))
+    # Validators of UserCreate report bad names as HTTP errors
+    except HTTPException as err:
+        raise ValueError(err.detail)
+
+
+async def _hash_passwords(passwords: list[str]) -> list:
+    """Hashes on all pool workers, leaving the queue to logins meanwhile"""
+    semaphore = asyncio.Semaphore(settings.HASHING_POOL_SIZE)
+
+    async def hash_password(password: str) -> str:
+        async with semaphore:
+            return await AsyncHasher.get_password_hash(password)
+
+    return await asyncio.gather(
+        *(hash_password(password) for password in passwords), return_exceptions=True
+    )
+
+
+async def _insert_batch(
+    batch: list[tuple[int, UserCreate]], session: AsyncSession
+) -> list[ImportedUserResult]:
+    hashed_passwords = await _hash_passwords([user.password for _, user in batch])
+    results, new_users, batch_emails = [], [], set()
+    for (line_number, user), hashed_password in zip(batch, hashed_passwords):
+        if isinstance(hashed_password, HashingUnavailableError):
+            results.append(
+                ImportedUserResult(
+                    line=line_number,
+                    status=ImportStatus.FAILED,
+                    detail=str(hashed_password),
+                )
+            )
+            continue
+        if isinstance(hashed_password, BaseException):
+            raise hashed_password
+        if user.email in batch_emails:
+            results.append(
+                ImportedUserResult(line=line_number, status=ImportStatus.CONFLICT)
+            )
+            continue
+        batch_emails.add(user.email)
+        new_users.append(
+            (
+                line_number,
+                {
+                    "user_id": uuid7(),
+                    "name": user.name,
+                    "surname": user.surname,
+                    "email": user.email,
+                    "is_active": True,
+                    "roles": encode_roles([PortalRole.ROLE_PORTAL_USER]),
+                },
+                hashed_password,
+            )
+        )
+    if new_users:
+        user_dal = UserDAL(session)
+        created_user_ids = await user_dal.create_users(
+            [new_user for _, new_user, _ in new_users],
+            {
+                new_user["user_id"]: hashed_password
+                for _, new_user, hashed_password in new_users
+            },
+        )
+        # Every batch is committed on its own, so a broken upload keeps the rest
+        await session.commit()
+        for line_number, new_user, _ in new_users:
+            if new_user["user_id"] in created_user_ids:
+                results.append(
+                    ImportedUserResult(
+                        line=line_number,
+                        status=ImportStatus.CREATED,
+                        user_id=new_user["user_id"],
+                    )
+                )
+            else:
+                results.append(
+                    ImportedUserResult(line=line_number, status=ImportStatus.CONFLICT)
+                )
+    return sorted(results, key=lambda result: result.line)
+
+
+async def _import_users(
+    chunks: AsyncIterator[bytes], content_type: str, session: AsyncSession
+) -> AsyncIterator[str]:
+    """Creates users from an NDJSON or CSV upload, yielding NDJSON results
+
+    Rows are hashed and inserted in batches, users whose email is taken are
+    reported as conflicts. CSV rows are single lines, quoted fields holding
+    line breaks are reported as invalid. An invalid CSV header is reported
+    and ends the upload, no row is imported then.
+    """
+    parse_row = ROW_PARSERS[content_type]
+    header, batch, line_number = None, [], 0
+    async for line in _iter_lines(chunks):
+        line_number += 1
+        if line is not None and not line.strip():
+            continue
+        if parse_row is _parse_csv_row and header is None:
+            try:
+                if line is None:
+                    raise ValueError("Line is too long")
+                header = _split_csv_line(line.rstrip("\r"))
+            except ValueError as err:
+                result = ImportedUserResult(
+                    line=line_number,
+                    status=ImportStatus.INVALID,
+                    detail=f"Header is invalid: {err}",
+                )
+                yield result.model_dump_json() + "\n"
+                return
+            continue
+        try:
+            if line is None:
+                raise ValueError("Line is too long")
+            batch.append(
+                (line_number, _validate_row(parse_row, line.rstrip("\r"), header))
+            )
+        except ValueError as err:
+            result = ImportedUserResult(
+                line=line_number, status=ImportStatus.INVALID, detail=str(err)
+            )
+            yield result.model_dump_json() + "\n"
+            continue
+        if len(batch) >= settings.USER_IMPORT_BATCH_SIZE:
+            for result in await _insert_batch(batch, session):
+                yield result.model_dump_json() + "\n"
+            batch = []
+    if batch:
+        for result in await _insert_batch(batch, session):
+            yield result.model_dump_json() + "\n"
@@ -1,25 +1,49 @@
 from logging import getLogger
+from typing import Literal
+from typing import Optional
+from typing import Union
 from uuid import UUID
 
 from fastapi import APIRouter
 from fastapi import Depends
 from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+import settings
+from api.actions.auth import get_current_principal_from_token
 from api.actions.auth import get_current_user_from_token
+from api.actions.auth import TokenPrincipal
+from api.actions.user import _change_admin_privilege
 from api.actions.user import _create_new_user
 from api.actions.user import _delete_user
 from api.actions.user import _get_user_by_id
-from api.actions.user import _update_user
-from api.actions.user import check_user_permissions
+from api.actions.user import _list_users
+from api.actions.user import _update_user_if_permitted
+from api.actions.user_export import _export_users
+from api.actions.user_export import EXPORT_FORMATS
+from api.actions.user_import import _import_users
+from api.actions.user_import import ImportResultsResponse
+from api.actions.user_import import ROW_PARSERS
+from api.schemas import AdminPrivilegeBulkRequest
+from api.schemas import AdminPrivilegeBulkResponse
+from api.schemas import AdminPrivilegeOutcome
 from api.schemas import DeleteUserResponse
 from api.schemas import ShowUser
 from api.schemas import UpdatedUserResponse
 from api.schemas import UpdateUserRequest
 from api.schemas import UserCreate
-from db.models import User
+from api.schemas import UserListOrder
+from api.schemas import UserListResponse
+from db.dals import AdminPrivilegeAction
+from db.dals import WriteOutcome
+from db.models import PortalRole
+from db.models import UserRecord
 from db.session import get_db
+from hashing import HashingUnavailableError
 
 logger = getLogger(__name__)
 
@@ -35,35 +59,73 @@ async def create_user(
     except IntegrityError as err:
         logger.error(err)
         raise HTTPException(status_code=503, detail=f"Database error: {err}")
+    except HashingUnavailableError as err:
+        logger.warning(err)
+        raise HTTPException(status_code=503, detail=str(err))
+
+
+@user_router.post("/import", response_class=ImportResultsResponse)
+async def import_users(
+    request: Request,
+    session: AsyncSession = Depends(get_db),
+    current_user: UserRecord = Depends(get_current_user_from_token),
+) -> ImportResultsResponse:
+    """Creates users from an NDJSON or CSV upload, streaming a result per row"""
+    if not (current_user.is_admin or current_user.is_superadmin):
+        raise HTTPException(status_code=403, detail="Forbidden.")
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ROW_PARSERS:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Import should be one of {', '.join(ROW_PARSERS)}",
+        )
+    return ImportResultsResponse(_import_users(request.stream(), content_type, session))
+
+
+@user_router.get("/export", response_class=StreamingResponse)
+async def export_users(
+    export_format: Literal["ndjson", "csv"] = Query(default="ndjson", alias="format"),
+    session: AsyncSession = Depends(get_db),
+    current_user: UserRecord = Depends(get_current_user_from_token),
+) -> StreamingResponse:
+    """Streams all users as NDJSON or CSV without loading them at once"""
+    if not (current_user.is_admin or current_user.is_superadmin):
+        raise HTTPException(status_code=403, detail="Forbidden.")
+    media_type, _ = EXPORT_FORMATS[export_format]
+    return StreamingResponse(
+        _export_users(export_format, session), media_type=media_type
+    )
 
 
 @user_router.delete("/", response_model=DeleteUserResponse)
 async def delete_user(
     user_id: UUID,
     session: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user_from_token),
+    current_user: UserRecord = Depends(get_current_user_from_token),
 ) -> DeleteUserResponse:
-    user_for_deletion = await _get_user_by_id(user_id, session)
-    if user_for_deletion is None:
+    outcome = await _delete_user(user_id, current_user, session)
+    if outcome == WriteOutcome.NOT_FOUND:
         raise HTTPException(status_code=404, detail=f"User with id {user_id} not found")
-    if not check_user_permissions(
-        target_user=user_for_deletion, current_user=current_user
-    ):
+    if outcome == WriteOutcome.FORBIDDEN:
+        if current_user.is_superadmin:
+            raise HTTPException(
+                status_code=406, detail="Superadmin cannot be deleted via API"
+            )
         raise HTTPException(status_code=403, detail="Forbidden")
-    deleted_user_id = await _delete_user(user_id, session)
-    if deleted_user_id is None:
-        raise HTTPException(
-            status_code=404, detail=f"User with id {user_id} is not found."
-        )
-    return DeleteUserResponse(deleted_user_id=deleted_user_id)
+    return DeleteUserResponse(deleted_user_id=user_id)
 
 
 @user_router.get("/", response_model=ShowUser)
 async def get_user_by_id(
     user_id: UUID,
     session: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user_from_token),
+    current_user: Union[UserRecord, TokenPrincipal] = Depends(
+        get_current_principal_from_token
+    ),
 ) -> ShowUser:
+    # Own profile is already loaded by the auth dependency unless token is stateless
+    if isinstance(current_user, UserRecord) and user_id == current_user.user_id:
+        return current_user
     user = await _get_user_by_id(user_id, session)
     # Checks if user exists
     if user is None:
@@ -73,12 +135,41 @@ async def get_user_by_id(
     return user
 
 
+@user_router.get("/list", response_model=UserListResponse)
+async def list_users(
+    order_by: UserListOrder = UserListOrder.USER_ID,
+    cursor: Optional[str] = None,
+    limit: int = Query(
+        default=settings.USER_LIST_DEFAULT_PAGE_SIZE,
+        ge=1,
+        le=settings.USER_LIST_MAX_PAGE_SIZE,
+    ),
+    is_active: Optional[bool] = None,
+    role: Optional[PortalRole] = None,
+    email_domain: Optional[str] = None,
+    session: AsyncSession = Depends(get_db),
+    current_user: UserRecord = Depends(get_current_user_from_token),
+) -> UserListResponse:
+    # Checks if current user is admin or super-admin
+    if not (current_user.is_admin or current_user.is_superadmin):
+        raise HTTPException(status_code=403, detail="Forbidden.")
+    return await _list_users(
+        order_by,
+        cursor,
+        limit,
+        session,
+        is_active=is_active,
+        role=role,
+        email_domain=email_domain,
+    )
+
+
 @user_router.patch("/", response_model=UpdatedUserResponse)
 async def update_user_by_id(
     user_id: UUID,
     body: UpdateUserRequest,
     session: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user_from_token),
+    current_user: UserRecord = Depends(get_current_user_from_token),
 ) -> UpdatedUserResponse:
     updated_user_params = body.model_dump(exclude_none=True)
     # Checks if there are any parameters passed for update
@@ -87,71 +178,96 @@ async def update_user_by_id(
             status_code=422,
             detail="At least one parameter for user update info should be provided",
         )
-    user_for_update = await _get_user_by_id(user_id, session)
-    # Checks if user was found
-    if user_for_update is None:
-        raise HTTPException(
-            status_code=404, detail=f"User with id {user_id} not found."
-        )
-    if user_id != current_user.user_id:
-        if check_user_permissions(
-            target_user=user_for_update, current_user=current_user
-        ):
-            raise HTTPException(status_code=403, detail="Forbidden.")
     # Ensures there is no error during updating user
     try:
-        updated_user_id = await _update_user(
-            updated_user_params=updated_user_params, session=session, user_id=user_id
+        outcome = await _update_user_if_permitted(
+            updated_user_params=updated_user_params,
+            user_id=user_id,
+            current_user=current_user,
+            session=session,
         )
     except IntegrityError as err:
         logger.error(err)
         raise HTTPException(status_code=503, detail=f"Database error: {err}")
-    return UpdatedUserResponse(updated_user_id=updated_user_id)
+    if outcome == WriteOutcome.NOT_FOUND:
+        raise HTTPException(
+            status_code=404, detail=f"User with id {user_id} not found."
+        )
+    if outcome == WriteOutcome.FORBIDDEN:
+        if current_user.is_superadmin:
+            raise HTTPException(
+                status_code=406, detail="Superadmin cannot update users via API"
+            )
+        raise HTTPException(status_code=403, detail="Forbidden.")
+    return UpdatedUserResponse(updated_user_id=user_id)
 
 
 @user_router.patch("/admin_privilege", response_model=UpdatedUserResponse)
 async def grant_admin_privilege(
     user_id: UUID,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user_from_token),
+    current_user: UserRecord = Depends(get_current_user_from_token),
 ):
-    # Checks if current user is super-admin
-    if not current_user.is_superadmin:
-        raise HTTPException(status_code=403, detail="Forbidden.")
-    # Ensures user cannot manage his own privileges
-    if current_user.user_id == user_id:
-        raise HTTPException(
-            status_code=400, detail="Cannot manage privileges of itself."
-        )
-    user_for_promotion = await _get_user_by_id(user_id, db)
-    # Checks if user already admin or super-admin
-    if user_for_promotion.is_admin or user_for_promotion.is_superadmin:
+    outcome = await _change_single_admin_privilege(
+        user_id, AdminPrivilegeAction.GRANT, db, current_user
+    )
+    if outcome == WriteOutcome.CONFLICT:
         raise HTTPException(
             status_code=409,
             detail=f"User with id {user_id} already promoted to admin / super-admin.",
         )
-    # Checks if user for promotion exists
-    if user_for_promotion is None:
-        raise HTTPException(
-            status_code=404, detail=f"User with id {user_id} not found."
-        )
-    updated_user_params = {"roles": user_for_promotion.add_admin_privileges_to_model()}
-    try:
-        updated_user_id = await _update_user(
-            updated_user_params=updated_user_params, session=db, user_id=user_id
-        )
-    except IntegrityError as err:
-        logger.error(err)
-        raise HTTPException(status_code=503, detail=f"Database error: {err}")
-    return UpdatedUserResponse(updated_user_id=updated_user_id)
+    return UpdatedUserResponse(updated_user_id=user_id)
 
 
 @user_router.delete("/admin_privilege", response_model=UpdatedUserResponse)
 async def revoke_admin_privilege(
     user_id: UUID,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user_from_token),
+    current_user: UserRecord = Depends(get_current_user_from_token),
 ):
+    outcome = await _change_single_admin_privilege(
+        user_id, AdminPrivilegeAction.REVOKE, db, current_user
+    )
+    if outcome == WriteOutcome.CONFLICT:
+        raise HTTPException(
+            status_code=409, detail=f"User with id {user_id} has no admin privileges."
+        )
+    return UpdatedUserResponse(updated_user_id=user_id)
+
+
+@user_router.post("/admin_privilege/bulk", response_model=AdminPrivilegeBulkResponse)
+async def change_admin_privilege_in_bulk(
+    body: AdminPrivilegeBulkRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: UserRecord = Depends(get_current_user_from_token),
+) -> AdminPrivilegeBulkResponse:
+    # Checks if current user is super-admin
+    if not current_user.is_superadmin:
+        raise HTTPException(status_code=403, detail="Forbidden.")
+    user_ids = list(dict.fromkeys(body.user_ids))
+    # Own privileges are reported as forbidden rather than changed
+    outcomes = {current_user.user_id: WriteOutcome.FORBIDDEN}
+    outcomes.update(
+        await _change_admin_privilege(
+            [user_id for user_id in user_ids if user_id != current_user.user_id],
+            body.action,
+            db,
+        )
+    )
+    return AdminPrivilegeBulkResponse(
+        results=[
+            AdminPrivilegeOutcome(user_id=user_id, outcome=outcomes[user_id])
+            for user_id in user_ids
+        ]
+    )
+
+
+async def _change_single_admin_privilege(
+    user_id: UUID,
+    action: AdminPrivilegeAction,
+    db: AsyncSession,
+    current_user: UserRecord,
+) -> WriteOutcome:
     # Checks if current user is super-admin
     if not current_user.is_superadmin:
         raise HTTPException(status_code=403, detail="Forbidden.")
@@ -160,25 +276,10 @@ async def revoke_admin_privilege(
         raise HTTPException(
             status_code=400, detail="Cannot manage privileges of itself."
         )
-    user_for_admin_privileges_revoke = await _get_user_by_id(user_id, db)
-    # Checks if user has any admin privileges to delete
-    if not user_for_admin_privileges_revoke.is_admin:
-        raise HTTPException(
-            status_code=409, detail=f"User with id {user_id} has no admin privileges."
-        )
-    # Checks if user for privilege revoking exists
-    if user_for_admin_privileges_revoke is None:
+    outcome = (await _change_admin_privilege([user_id], action, db))[user_id]
+    # Checks if user for privilege change exists
+    if outcome == WriteOutcome.NOT_FOUND:
         raise HTTPException(
             status_code=404, detail=f"User with id {user_id} not found."
         )
-    updated_user_params = {
-        "roles": user_for_admin_privileges_revoke.remove_admin_privileges_from_model()
-    }
-    try:
-        updated_user_id = await _update_user(
-            updated_user_params=updated_user_params, session=db, user_id=user_id
-        )
-    except IntegrityError as err:
-        logger.error(err)
-        raise HTTPException(status_code=503, detail=f"Database error: {err}")
-    return UpdatedUserResponse(updated_user_id=updated_user_id)
+    return outcome
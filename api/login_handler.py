@@ -1,5 +1,5 @@
-import json
 from datetime import timedelta
+from logging import getLogger
 
 from fastapi import APIRouter
 from fastapi import Depends
@@ -9,30 +9,82 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 import settings
+from admission import admit_login
+from api.actions.auth import _issue_refresh_token
+from api.actions.auth import _revoke_refresh_token
+from api.actions.auth import _rotate_refresh_token
 from api.actions.auth import authenticate_user
+from api.actions.auth import build_access_token_claims
+from api.schemas import RefreshTokenRequest
+from api.schemas import RevokedTokenResponse
 from api.schemas import Token
 from db.session import get_db
+from hashing import HashingUnavailableError
 from security import create_access_token
-from security import UUIDEncoder
+
+logger = getLogger(__name__)
 
 login_router = APIRouter()
 
 
-@login_router.post("/token", response_model=Token)
+@login_router.post("/token", response_model=Token, dependencies=[Depends(admit_login)])
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
     session: AsyncSession = Depends(get_db),
 ):
-    user = await authenticate_user(form_data.username, form_data.password, session)
+    try:
+        user = await authenticate_user(form_data.username, form_data.password, session)
+    except HashingUnavailableError as err:
+        logger.warning(err)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(err)
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKE_EXPIRE_MINUTES)
-    encoded_uuid = json.dumps(user.user_id, cls=UUIDEncoder)
     access_token = create_access_token(
-        data={"sub": encoded_uuid, "other_custom_data": [1, 2, 3, 4]},
+        data=build_access_token_claims(user),
         expires_delta=access_token_expires,
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    refresh_token = await _issue_refresh_token(user.user_id, session)
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+
+
+@login_router.post("/refresh", response_model=Token)
+async def refresh_access_token(
+    body: RefreshTokenRequest,
+    session: AsyncSession = Depends(get_db),
+):
+    # One indexed update and one signature, no password hashing
+    refresh_token, user = await _rotate_refresh_token(body.refresh_token, session)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+        )
+    access_token_expires = timedelta(minutes=settings.ACCESS_TOKE_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data=build_access_token_claims(user),
+        expires_delta=access_token_expires,
+    )
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+
+
+@login_router.post("/revoke", response_model=RevokedTokenResponse)
+async def revoke_refresh_token(
+    body: RefreshTokenRequest,
+    session: AsyncSession = Depends(get_db),
+) -> RevokedTokenResponse:
+    revoked = await _revoke_refresh_token(body.refresh_token, session)
+    return RevokedTokenResponse(revoked=revoked)
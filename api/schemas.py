@@ -7,7 +7,14 @@ from pydantic import BaseModel
 from pydantic import ConfigDict
 from pydantic import constr
 from pydantic import EmailStr
+from pydantic import Field
 from pydantic import field_validator
+from strenum import StrEnum
+
+import settings
+from db.dals import AdminPrivilegeAction
+from db.dals import WriteOutcome
+from db.models import normalize_email
 
 #########################
 # BLOCK WITH API MODELS #
@@ -39,6 +46,10 @@ class UserCreate(BaseModel):
     email: EmailStr
     password: str
 
+    @field_validator("email")
+    def normalize_email_field(cls, value):
+        return normalize_email(value)
+
     @field_validator("name")
     def validate_name(cls, value):
         if not LETTER_MATCH_PATTERN.match(value):
@@ -56,6 +67,17 @@ class UserCreate(BaseModel):
         return value
 
 
+class UserListOrder(StrEnum):
+    USER_ID = "user_id"
+    EMAIL = "email"
+
+
+class UserListResponse(BaseModel):
+    users: list[ShowUser]
+    # Passed as cursor to get the next page, missing on the last one
+    next_cursor: Optional[str] = None
+
+
 class DeleteUserResponse(BaseModel):
     deleted_user_id: uuid.UUID
 
@@ -69,6 +91,10 @@ class UpdateUserRequest(BaseModel):
     surname: Optional[constr(min_length=1)]
     email: Optional[EmailStr]
 
+    @field_validator("email")
+    def normalize_email_field(cls, value):
+        return normalize_email(value) if value is not None else value
+
     @field_validator("name")
     def validate_name(cls, value):
         if not LETTER_MATCH_PATTERN.match(value):
@@ -89,3 +115,42 @@ class UpdateUserRequest(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+
+class RevokedTokenResponse(BaseModel):
+    revoked: bool
+
+
+class AdminPrivilegeBulkRequest(BaseModel):
+    user_ids: list[uuid.UUID] = Field(
+        min_length=1, max_length=settings.ADMIN_PRIVILEGE_BULK_MAX_USERS
+    )
+    action: AdminPrivilegeAction
+
+
+class AdminPrivilegeOutcome(BaseModel):
+    user_id: uuid.UUID
+    outcome: WriteOutcome
+
+
+class AdminPrivilegeBulkResponse(BaseModel):
+    results: list[AdminPrivilegeOutcome]
+
+
+class ImportStatus(StrEnum):
+    CREATED = "created"
+    CONFLICT = "conflict"
+    INVALID = "invalid"
+    FAILED = "failed"
+
+
+class ImportedUserResult(BaseModel):
+    line: int
+    status: ImportStatus
+    user_id: Optional[uuid.UUID] = None
+    detail: Optional[str] = None
@@ -1,5 +1,9 @@
 """File for checking application giving response"""
 from fastapi import APIRouter
+from fastapi import Response
+
+import settings
+from security import get_signing_keys
 
 service_router = login_router = APIRouter()
 
@@ -7,3 +11,10 @@ service_router = login_router = APIRouter()
 @service_router.get("/ping")
 async def ping():
     return {"Success": True}
+
+
+@service_router.get("/.well-known/jwks.json")
+async def jwks(response: Response):
+    """Public keys for verifying access tokens without calling this service"""
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return get_signing_keys(settings.JWT_BACKEND).jwks
@@ -0,0 +1,109 @@
+"""Calibration of password hash costs for this host
+
+Measures verification latency of candidate scheme settings with every hashing
+worker busy, as during a login burst, and picks the strongest setting whose p99
+fits the target. Run from the project root:
+
+    APP_PORT=8000 SENTRY_URL= python -m benchmarks.calibrate_hashing --target-p99-ms 250
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.registry import get_crypt_handler
+
+import settings
+from hashing import build_pwd_context
+
+# Candidates per scheme from the weakest to the strongest, schemes themselves
+# are listed from the most to the least preferred one
+CANDIDATES = {
+    "argon2": [
+        {"argon2__time_cost": t, "argon2__memory_cost": m, "argon2__parallelism": 4}
+        for t, m in [(2, 19456), (2, 32768), (3, 65536), (4, 131072), (6, 262144)]
+    ],
+    "bcrypt": [{"bcrypt__default_rounds": rounds} for rounds in range(10, 16)],
+    "sha256_crypt": [
+        {"sha256_crypt__default_rounds": rounds}
+        for rounds in [100000, 200000, 300000, 535000, 800000, 1200000, 2000000]
+    ],
+}
+
+SETTING_NAMES = {
+    "argon2__time_cost": "ARGON2_TIME_COST",
+    "argon2__memory_cost": "ARGON2_MEMORY_COST",
+    "argon2__parallelism": "ARGON2_PARALLELISM",
+    "bcrypt__default_rounds": "BCRYPT_ROUNDS",
+    "sha256_crypt__default_rounds": "SHA256_CRYPT_ROUNDS",
+}
+
+
+def _time_verification(scheme: str, scheme_settings: dict, hashed_password: str):
+    pwd_context = build_pwd_context([scheme], **scheme_settings)
+    started_at = time.perf_counter()
+    pwd_context.verify("CalibrationPass1!", hashed_password)
+    return time.perf_counter() - started_at
+
+
+def _measure_p99(
+    executor: ProcessPoolExecutor, scheme: str, scheme_settings: dict, samples: int
+) -> float:
+    hashed_password = build_pwd_context([scheme], **scheme_settings).hash(
+        "CalibrationPass1!"
+    )
+    durations = list(
+        executor.map(
+            _time_verification,
+            [scheme] * samples,
+            [scheme_settings] * samples,
+            [hashed_password] * samples,
+        )
+    )
+    return statistics.quantiles(durations, n=100)[98]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target-p99-ms", type=float, default=250.0)
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=max(100, settings.HASHING_POOL_SIZE * 10),
+        help="Verifications per candidate, spread over the hashing pool",
+    )
+    parser.add_argument("--schemes", nargs="+", default=list(CANDIDATES))
+    args = parser.parse_args()
+
+    print(f"Hashing pool size: {settings.HASHING_POOL_SIZE}")
+    chosen = {}
+    with ProcessPoolExecutor(max_workers=settings.HASHING_POOL_SIZE) as executor:
+        for scheme in args.schemes:
+            if not get_crypt_handler(scheme).has_backend():
+                print(f"{scheme}: skipped, backend library is not installed")
+                continue
+            for scheme_settings in CANDIDATES[scheme]:
+                p99_ms = (
+                    _measure_p99(executor, scheme, scheme_settings, args.samples) * 1000
+                )
+                fits = p99_ms <= args.target_p99_ms
+                print(f"{scheme}: {scheme_settings} p99={p99_ms:.1f}ms")
+                if not fits:
+                    # Stronger candidates of the scheme would be even slower
+                    break
+                chosen[scheme] = scheme_settings
+
+    if not chosen:
+        print("No candidate fits the target, consider a bigger hashing pool")
+        return
+    scheme = next(scheme for scheme in args.schemes if scheme in chosen)
+    print("\nRecommended settings:")
+    # Keeps other schemes so existing hashes still verify and get upgraded
+    other_schemes = [name for name in CANDIDATES if name != scheme]
+    print(f"PASSWORD_HASH_SCHEMES={','.join([scheme, *other_schemes])}")
+    for name, value in chosen[scheme].items():
+        print(f"{SETTING_NAMES[name]}={value}")
+
+
+if __name__ == "__main__":
+    main()
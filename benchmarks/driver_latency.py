@@ -0,0 +1,167 @@
+"""Request latency of the user endpoints with asyncpg and with psycopg pipelines
+
+Sends requests to the app in process, with `get_db` sessions of an engine per
+driver, and reports the p50 and p99 of each endpoint. Under psycopg the writes
+go out along with their commit in pipeline mode. The principal cache is cleared
+before each request, so the auth lookup reads the database as well. Run from
+the project root against a local database:
+
+    APP_PORT=8000 SENTRY_URL= python -m benchmarks.driver_latency --requests 2000
+"""
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+import httpx
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from api.actions.auth import build_access_token_claims
+from db.dals import principal_cache
+from db.dals import RefreshTokenDAL
+from db.dals import UserDAL
+from db.models import PortalRole
+from db.models import User
+from db.session import create_engine_from_settings
+from db.session import get_db
+from main import app
+from security import create_access_token
+from security import create_refresh_token
+
+DRIVERS = ["asyncpg", "psycopg"]
+
+
+async def _create_user(session: AsyncSession, role: PortalRole):
+    return await UserDAL(session).create_user(
+        name="Benchmark",
+        surname="Client",
+        email=f"benchmark-{uuid.uuid4().hex}@example.com",
+        hashed_password="-",
+        roles=[role],
+    )
+
+
+async def _refresh(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    response = await client.post(
+        "/login/refresh", json={"refresh_token": state["refresh_token"]}
+    )
+    # Tokens are used once, the next request goes with the new one
+    state["refresh_token"] = response.json()["refresh_token"]
+    return response
+
+
+def _endpoints(admin_headers: dict, user_id: uuid.UUID) -> dict:
+    params = {"user_id": str(user_id)}
+    names = itertools.cycle(["Leo", "Artem"])
+    return {
+        "get user": lambda client, state: client.get(
+            "/user/", params=params, headers=admin_headers
+        ),
+        "list users": lambda client, state: client.get(
+            "/user/list", params={"limit": 20}, headers=admin_headers
+        ),
+        "update user": lambda client, state: client.patch(
+            "/user/",
+            params=params,
+            json={"name": next(names), "surname": "Client", "email": None},
+            headers=admin_headers,
+        ),
+        "refresh token": _refresh,
+    }
+
+
+async def measure(client, send, state: dict, requests: int) -> list[float]:
+    latencies = []
+    for _ in range(requests):
+        principal_cache.clear()
+        started_at = time.perf_counter()
+        response = await send(client, state)
+        latencies.append(time.perf_counter() - started_at)
+        response.raise_for_status()
+    return latencies
+
+
+@asynccontextmanager
+async def app_client(engine):
+    """Client of the app with `get_db` sessions of `engine`, and its endpoints
+
+    Endpoints are called with the client and a state they share, the users
+    they act on are deleted on exit.
+    """
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    async def get_benchmark_db():
+        # Same unit of work as get_db
+        session = session_factory()
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+    app.dependency_overrides[get_db] = get_benchmark_db
+    async with session_factory() as session:
+        admin = await _create_user(session, PortalRole.ROLE_PORTAL_ADMIN)
+        user = await _create_user(session, PortalRole.ROLE_PORTAL_USER)
+        refresh_token, token_hash = create_refresh_token()
+        await RefreshTokenDAL(session).create_refresh_token(
+            user_id=user.user_id,
+            token_hash=token_hash,
+            expires_at=datetime.now(timezone.utc) + timedelta(days=1),
+        )
+        await session.commit()
+    access_token = create_access_token(
+        data=build_access_token_claims(admin),
+        expires_delta=timedelta(minutes=settings.ACCESS_TOKE_EXPIRE_MINUTES),
+    )
+    admin_headers = {"Authorization": f"Bearer {access_token}"}
+    state = {"refresh_token": refresh_token}
+    try:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://benchmark"
+        ) as client:
+            yield client, _endpoints(admin_headers, user.user_id), state
+    finally:
+        async with engine.begin() as connection:
+            await connection.execute(
+                delete(User).where(User.user_id.in_([admin.user_id, user.user_id]))
+            )
+        app.dependency_overrides.pop(get_db)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--database-url", default=settings.REAL_DATABASE_URL)
+    args = parser.parse_args()
+
+    print(f"{'endpoint':<14} {'driver':<8} {'p50 ms':>8} {'p99 ms':>8}")
+    for driver in DRIVERS:
+        engine = create_engine_from_settings(args.database_url, driver=driver)
+        async with app_client(engine) as (client, endpoints, state):
+            for name, send in endpoints.items():
+                # Warms up the statement caches and the connection pool
+                await measure(client, send, state, 100)
+                latencies = await measure(client, send, state, args.requests)
+                percentiles = statistics.quantiles(latencies, n=100)
+                print(
+                    f"{name:<14} {driver:<8} {percentiles[49] * 1e3:>8.2f} "
+                    f"{percentiles[98] * 1e3:>8.2f}"
+                )
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""Microbenchmark of access token decoding throughput
+
+Compares every JWT backend from security.JWT_BACKENDS, then the verified-token
+cache alone, which serves hits the same way whatever the backend. Run from the
+project root:
+
+    APP_PORT=8000 SENTRY_URL= python -m benchmarks.jwt_decode --iterations 20000
+"""
+import argparse
+import json
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+import security
+import settings
+
+
+def _measure(decode, token: str, iterations: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        decode(token)
+    return iterations / (time.perf_counter() - started_at)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'backend':<8} {'cache':<6} {'decodes/s':>12}")
+    for name in security.JWT_BACKENDS:
+        try:
+            backend = security.get_jwt_backend(name)
+        except ImportError:
+            print(f"{name:<8} skipped, library is not installed")
+            continue
+        signing_keys = security.get_signing_keys(name)
+        token = backend.encode(
+            {
+                "sub": json.dumps(uuid4(), cls=security.UUIDEncoder),
+                "exp": int(time.time() + timedelta(minutes=30).total_seconds()),
+            },
+            signing_keys.signing_key,
+            algorithm=settings.ALGORITHM,
+            headers={"kid": signing_keys.key_id} if signing_keys.key_id else None,
+        )
+        verification_key = signing_keys.verification_keys[signing_keys.key_id]
+        uncached = _measure(
+            lambda t: backend.decode(
+                t, verification_key, algorithms=[settings.ALGORITHM]
+            ),
+            token,
+            args.iterations,
+        )
+        print(f"{name:<8} {'off':<6} {uncached:>12.0f}")
+
+    # Only the first lookup misses, the rest measure the cache alone
+    token = security.create_access_token(
+        {"sub": json.dumps(uuid4(), cls=security.UUIDEncoder)},
+        expires_delta=timedelta(minutes=30),
+    )
+    security.token_cache.clear()
+    cached = _measure(security.decode_access_token, token, args.iterations)
+    print(f"{'any':<8} {'only':<6} {cached:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""App workers one Postgres sustains, with and without PgBouncer
+
+Without PgBouncer every worker keeps its own pool, so Postgres takes
+
+    workers = (max_connections - reserved) / (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+In transaction pooling mode a request holds one of the server connections of
+PgBouncer only while its transaction is open. A busy worker holding one for
+the share h of its time, a server pool of P connections takes
+
+    workers = P / h
+
+The share is measured per endpoint, sending requests to the app in process as
+`benchmarks.driver_latency` does, and the largest one gives the workers. With
+DB_PGBOUNCER set, requests open a connection each as they do behind PgBouncer.
+Run from the project root against a local database:
+
+    APP_PORT=8000 SENTRY_URL= python -m benchmarks.pgbouncer_capacity
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import event
+
+import settings
+from benchmarks.driver_latency import app_client
+from benchmarks.driver_latency import measure
+from db.session import create_engine_from_settings
+
+
+def _time_transactions(engine, held: list[float]) -> None:
+    @event.listens_for(engine.sync_engine, "begin")
+    def begin(conn):
+        conn.info["transaction_began_at"] = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "commit")
+    @event.listens_for(engine.sync_engine, "rollback")
+    def end(conn):
+        held[0] += time.perf_counter() - conn.info.pop("transaction_began_at")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--database-url", default=settings.REAL_DATABASE_URL)
+    parser.add_argument("--max-connections", type=int, default=100)
+    parser.add_argument("--reserved-connections", type=int, default=3)
+    parser.add_argument("--server-pool-size", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine_from_settings(args.database_url)
+    held = [0.0]
+    _time_transactions(engine, held)
+    shares = []
+    print(f"{'endpoint':<14} {'request ms':>11} {'transaction ms':>15} {'share':>6}")
+    async with app_client(engine) as (client, endpoints, state):
+        for name, send in endpoints.items():
+            await measure(client, send, state, 100)
+            held[0] = 0.0
+            elapsed = sum(await measure(client, send, state, args.requests))
+            shares.append(held[0] / elapsed)
+            print(
+                f"{name:<14} {elapsed / args.requests * 1e3:>11.2f} "
+                f"{held[0] / args.requests * 1e3:>15.2f} {shares[-1]:>6.2f}"
+            )
+    await engine.dispose()
+
+    pooled = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    available = args.max_connections - args.reserved_connections
+    print(f"Workers without PgBouncer: {available // pooled}")
+    print(f"Workers with PgBouncer: {int(args.server_pool_size / max(shares))}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
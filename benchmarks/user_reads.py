@@ -0,0 +1,116 @@
+"""CPU time and memory per user read, ORM entities against Core records
+
+Reads one scratch user by id per simulated request, in a session of its own,
+and converts it to the ShowUser response model, once by hydrating a `User`
+entity and once through `UserDAL.get_user_by_id` building a `UserRecord`.
+CPU time is the process time of the whole request. Memory is the peak traced
+during a request, and what a loaded user keeps taking, as in the principal
+cache, both measured in separate passes since tracing slows the process down.
+Run from the project root:
+
+    APP_PORT=8000 SENTRY_URL= python -m benchmarks.user_reads --requests 20000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+import uuid
+
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from api.schemas import ShowUser
+from db.dals import UserDAL
+from db.models import PortalRole
+from db.models import User
+from db.models import UserRecord
+
+
+async def _orm_load(session: AsyncSession, user_id: uuid.UUID) -> User:
+    res = await session.execute(select(User).where(User.user_id == user_id))
+    user = res.scalar()
+    session.expunge(user)
+    return user
+
+
+async def _record_load(session: AsyncSession, user_id: uuid.UUID) -> UserRecord:
+    return await UserDAL(session).get_user_by_id(user_id)
+
+
+LOADS = {"orm": _orm_load, "record": _record_load}
+
+
+async def _run(session_factory, load, user_id: uuid.UUID, requests: int, traced):
+    cpu_seconds, peak_bytes = 0.0, 0
+    for _ in range(requests):
+        if traced:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+        started_at = time.process_time()
+        async with session_factory() as session:
+            ShowUser.model_validate(await load(session, user_id))
+        cpu_seconds += time.process_time() - started_at
+        if traced:
+            peak_bytes += tracemalloc.get_traced_memory()[1] - baseline
+    return cpu_seconds / requests, peak_bytes / requests
+
+
+async def _retained(session_factory, load, user_id: uuid.UUID, count: int) -> float:
+    users = []
+    baseline, _ = tracemalloc.get_traced_memory()
+    for _ in range(count):
+        async with session_factory() as session:
+            users.append(await load(session, user_id))
+    return (tracemalloc.get_traced_memory()[0] - baseline) / count
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--database-url", default=settings.REAL_DATABASE_URL)
+    args = parser.parse_args()
+
+    engine = create_async_engine(args.database_url)
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with session_factory() as session:
+        user = await UserDAL(session).create_user(
+            name="Benchmark",
+            surname="Reader",
+            email=f"benchmark-{uuid.uuid4().hex}@example.com",
+            hashed_password="-",
+            roles=[PortalRole.ROLE_PORTAL_USER],
+        )
+        await session.commit()
+    try:
+        print(
+            f"{'path':<8} {'CPU us/req':>12} {'peak KiB/req':>14} "
+            f"{'kept B/user':>12}"
+        )
+        for name, load in LOADS.items():
+            # Warms up the statement caches of SQLAlchemy and asyncpg
+            await _run(session_factory, load, user.user_id, 100, traced=False)
+            cpu_seconds, _ = await _run(
+                session_factory, load, user.user_id, args.requests, traced=False
+            )
+            tracemalloc.start()
+            _, peak_bytes = await _run(
+                session_factory, load, user.user_id, args.requests // 10, traced=True
+            )
+            kept_bytes = await _retained(session_factory, load, user.user_id, 1000)
+            tracemalloc.stop()
+            print(
+                f"{name:<8} {cpu_seconds * 1e6:>12.1f} {peak_bytes / 1024:>14.1f} "
+                f"{kept_bytes:>12.0f}"
+            )
+    finally:
+        async with engine.begin() as connection:
+            await connection.execute(delete(User).where(User.user_id == user.user_id))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Insert throughput and primary key index size for uuid4 and uuid7 keys
+
+Fills a scratch table per scheme shaped like the users primary key, then
+reports rows per second, WAL written and the size of the primary key index.
+Id generation happens outside of the timed part. Run from the project root
+against a database that can take the load:
+
+    APP_PORT=8000 SENTRY_URL= python -m benchmarks.uuid_inserts --rows 10000000
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import asyncpg
+
+import settings
+from db.models import uuid7
+
+SCHEMES = {"uuid4": uuid.uuid4, "uuid7": uuid7}
+
+
+async def _fill(connection, table: str, generate, rows: int, batch_size: int):
+    await connection.execute(f"DROP TABLE IF EXISTS {table}")
+    await connection.execute(
+        f"CREATE TABLE {table} (user_id uuid PRIMARY KEY, email varchar NOT NULL)"
+    )
+    wal_before = await connection.fetchval("SELECT pg_current_wal_lsn()")
+    elapsed = 0.0
+    for start in range(0, rows, batch_size):
+        records = [
+            (generate(), f"user{index}@example.com")
+            for index in range(start, min(start + batch_size, rows))
+        ]
+        started_at = time.perf_counter()
+        await connection.copy_records_to_table(table, records=records)
+        elapsed += time.perf_counter() - started_at
+    wal_bytes = await connection.fetchval(
+        "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), $1)", wal_before
+    )
+    index_bytes = await connection.fetchval(
+        "SELECT pg_relation_size($1::regclass)", f"{table}_pkey"
+    )
+    await connection.execute(f"DROP TABLE {table}")
+    return rows / elapsed, wal_bytes, index_bytes
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument(
+        "--database-url",
+        default="".join(settings.REAL_DATABASE_URL.split("+asyncpg")),
+    )
+    args = parser.parse_args()
+
+    connection = await asyncpg.connect(args.database_url)
+    try:
+        print(f"{'scheme':<8} {'rows/s':>10} {'WAL MiB':>10} {'pkey MiB':>10}")
+        for name, generate in SCHEMES.items():
+            rows_per_second, wal_bytes, index_bytes = await _fill(
+                connection,
+                f"benchmark_{name}_keys",
+                generate,
+                args.rows,
+                args.batch_size,
+            )
+            print(
+                f"{name:<8} {rows_per_second:>10.0f} "
+                f"{wal_bytes / 2**20:>10.1f} {index_bytes / 2**20:>10.1f}"
+            )
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Hashable
+from typing import Optional
+
+from prometheus_client import Counter
+from prometheus_client import Gauge
+
+CACHE_HITS = Counter("cache_hits_total", "Lookups served from the cache", ["cache"])
+CACHE_MISSES = Counter(
+    "cache_misses_total", "Lookups not found in the cache or expired", ["cache"]
+)
+CACHE_EVICTIONS = Counter(
+    "cache_evictions_total",
+    "Entries removed from the cache before being read again",
+    ["cache", "reason"],
+)
+CACHE_ENTRIES = Gauge("cache_entries", "Entries currently held in the cache", ["cache"])
+
+
+class TTLCache:
+    """In-process cache bounded by size (LRU) and by entry lifetime"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Key -> (expires_at, value), ordered from least to most recently used
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            CACHE_MISSES.labels(cache=self.name).inc()
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            self._remove(key, reason="expired")
+            CACHE_MISSES.labels(cache=self.name).inc()
+            return None
+        self._entries.move_to_end(key)
+        CACHE_HITS.labels(cache=self.name).inc()
+        return value
+
+    def set(
+        self, key: Hashable, value: Any, expires_at: Optional[float] = None
+    ) -> None:
+        # Zero size disables the cache entirely
+        if self.maxsize <= 0:
+            return
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key, reason="capacity")
+        CACHE_ENTRIES.labels(cache=self.name).set(len(self._entries))
+
+    def invalidate(self, key: Hashable) -> None:
+        if key in self._entries:
+            self._remove(key, reason="invalidated")
+
+    def clear(self) -> None:
+        self._entries.clear()
+        CACHE_ENTRIES.labels(cache=self.name).set(0)
+
+    def _remove(self, key: Hashable, reason: str) -> None:
+        del self._entries[key]
+        CACHE_EVICTIONS.labels(cache=self.name, reason=reason).inc()
+        CACHE_ENTRIES.labels(cache=self.name).set(len(self._entries))
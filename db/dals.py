@@ -1,13 +1,52 @@
+from datetime import datetime
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
 from typing import Optional
+from typing import Union
+from uuid import uuid4
 
 from sqlalchemy import and_
+from sqlalchemy import any_
+from sqlalchemy import bindparam
+from sqlalchemy import DateTime
+from sqlalchemy import event
+from sqlalchemy import false
+from sqlalchemy import func
+from sqlalchemy import or_
 from sqlalchemy import select
+from sqlalchemy import String
 from sqlalchemy import update
 from sqlalchemy import UUID
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import ColumnElement
+from strenum import StrEnum
 
+import settings
+from cache import TTLCache
+from db.models import email_domain_of
+from db.models import encode_roles
+from db.models import has_role
+from db.models import normalize_email
 from db.models import PortalRole
+from db.models import RefreshToken
+from db.models import ROLE_BITS
 from db.models import User
+from db.models import UserCredential
+from db.models import UserRecord
+from db.models import UserShard
+from db.models import uuid7
+from db.session import DIRECTORY_SHARD
+from db.session import execute_pipelined
+
+# Authenticated users by user_id, holding UserRecord instances
+principal_cache = TTLCache(
+    "principal",
+    maxsize=settings.PRINCIPAL_CACHE_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+)
 
 
 ###########################################################
@@ -15,12 +54,265 @@ from db.models import User
 ###########################################################
 
 
-class UserDAL:
-    """Data Access Layer(DAL) for operating user info"""
+class WriteOutcome(StrEnum):
+    NOT_FOUND = "not_found"
+    FORBIDDEN = "forbidden"
+    CONFLICT = "conflict"
+    SUCCESS = "success"
+
+
+class AdminPrivilegeAction(StrEnum):
+    GRANT = "grant"
+    REVOKE = "revoke"
+
+
+def _manageable_by(current_user) -> ColumnElement[bool]:
+    """Predicate on users rows the current user may update or delete
+
+    Anyone may manage itself. Admins may manage others except admins and
+    super-admins. Super-admins may manage no one else via API.
+    """
+    users = User.__table__
+    is_self = users.c.user_id == current_user.user_id
+    if current_user.is_superadmin:
+        return is_self
+    if current_user.is_admin:
+        return or_(
+            is_self,
+            ~or_(
+                has_role(users.c.roles, PortalRole.ROLE_PORTAL_ADMIN),
+                has_role(users.c.roles, PortalRole.ROLE_PORTAL_SUPERADMIN),
+            ),
+        )
+    return is_self
+
+
+def _revoke_refresh_tokens_of(user_ids):
+    refresh_tokens = RefreshToken.__table__
+    return (
+        update(refresh_tokens)
+        .where(
+            and_(
+                refresh_tokens.c.user_id.in_(select(user_ids.c.user_id)),
+                refresh_tokens.c.revoked == False,
+            )
+        )
+        .values(revoked=True)
+    )
+
+
+def _named(statement, name: str):
+    """Labels a statement in the compile cache metric"""
+    return statement.execution_options(statement_name=name)
+
+
+# Statements of the hot paths are built once with bound parameters, so their
+# cache keys are computed once as well, and render the same SQL each time for
+# the prepared statements asyncpg keeps per connection. Parameters of inserts
+# and updates get a b_ prefix, column names are reserved there
+_USER_BY_ID = _named(
+    select(*UserRecord.columns()).where(
+        User.__table__.c.user_id == bindparam("user_id")
+    ),
+    "user_by_id",
+)
+_USER_BY_EMAIL = _named(
+    select(*UserRecord.columns()).where(User.__table__.c.email == bindparam("email")),
+    "user_by_email",
+)
+_USER_WITH_PASSWORD_BY_EMAIL = _named(
+    select(*UserRecord.columns(), UserCredential.__table__.c.hashed_password)
+    .join(
+        UserCredential.__table__,
+        UserCredential.__table__.c.user_id == User.__table__.c.user_id,
+    )
+    .where(User.__table__.c.email == bindparam("email")),
+    "user_with_password_by_email",
+)
+_UPDATE_PASSWORD = _named(
+    update(UserCredential.__table__)
+    .where(UserCredential.__table__.c.user_id == bindparam("b_user_id"))
+    .values(hashed_password=bindparam("b_hashed_password"))
+    .returning(UserCredential.__table__.c.user_id),
+    "update_password",
+)
+_SHARD_BY_EMAIL = _named(
+    select(UserShard.__table__.c.shard).where(
+        UserShard.__table__.c.email == bindparam("email")
+    ),
+    "shard_by_email",
+)
+# An array instead of an IN list keeps the SQL the same for any number of ids
+_SHARDS_BY_USER_IDS = _named(
+    select(UserShard.__table__.c.user_id, UserShard.__table__.c.shard).where(
+        UserShard.__table__.c.user_id
+        == any_(bindparam("user_ids", type_=ARRAY(UUID(as_uuid=True))))
+    ),
+    "shards_by_user_ids",
+)
+# Columns with Python-side defaults are given, pipelined writes compute none
+_CREATE_REFRESH_TOKEN = _named(
+    insert(RefreshToken.__table__)
+    .from_select(
+        ["token_id", "user_id", "token_hash", "expires_at", "revoked"],
+        select(
+            bindparam("b_token_id", type_=UUID(as_uuid=True)),
+            User.__table__.c.user_id,
+            bindparam("b_token_hash", type_=String),
+            bindparam("b_expires_at", type_=DateTime(timezone=True)),
+            false(),
+        ).where(User.__table__.c.user_id == bindparam("b_user_id")),
+    )
+    .returning(RefreshToken.__table__.c.token_id),
+    "create_refresh_token",
+)
+# Core tables, since ORM updates cannot return columns of another entity
+_ROTATE_REFRESH_TOKEN = _named(
+    update(RefreshToken.__table__)
+    .where(
+        and_(
+            RefreshToken.__table__.c.token_hash == bindparam("b_token_hash"),
+            RefreshToken.__table__.c.revoked == False,
+            RefreshToken.__table__.c.expires_at > func.now(),
+            RefreshToken.__table__.c.user_id == User.__table__.c.user_id,
+            User.__table__.c.is_active == True,
+        )
+    )
+    .values(revoked=True)
+    .returning(
+        User.__table__.c.user_id,
+        User.__table__.c.roles,
+        User.__table__.c.is_active,
+        User.__table__.c.security_version,
+    ),
+    "rotate_refresh_token",
+)
+_REVOKE_REFRESH_TOKEN = _named(
+    update(RefreshToken.__table__)
+    .where(
+        and_(
+            RefreshToken.__table__.c.token_hash == bindparam("b_token_hash"),
+            RefreshToken.__table__.c.revoked == False,
+        )
+    )
+    .values(revoked=True)
+    .returning(RefreshToken.__table__.c.token_id),
+    "revoke_refresh_token",
+)
+
+
+def _on(shard: Optional[str]) -> dict:
+    """Execute arguments running a statement on a shard, none when not sharded"""
+    return {} if shard is None else {"bind_arguments": {"shard_id": shard}}
+
+
+class _ShardRouting:
+    """Finds the shards of users when the session spans several of them
+
+    The hash ring places users and tells their shard without a lookup. Users
+    it misses are not moved yet by a rebalancing, or were moved meanwhile,
+    so the directory is asked where they are.
+    """
 
     def __init__(self, db_session: AsyncSession) -> None:
         # Initializing database session
         self.db_session = db_session
+        self.ring = getattr(db_session.sync_session, "ring", None)
+
+    @property
+    def shards(self) -> list[Optional[str]]:
+        return [None] if self.ring is None else self.ring.shards
+
+    def _group_by_shard(self, user_ids) -> dict[Optional[str], list]:
+        groups = {}
+        for user_id in user_ids:
+            shard = None if self.ring is None else self.ring.shard_for(user_id)
+            groups.setdefault(shard, []).append(user_id)
+        return groups
+
+    async def _directory_shards(self, user_ids: list[UUID]) -> dict[UUID, str]:
+        res = await self.db_session.execute(
+            _SHARDS_BY_USER_IDS, {"user_ids": user_ids}, **_on(DIRECTORY_SHARD)
+        )
+        return dict(res.all())
+
+    async def _run_where_found(
+        self,
+        shard: Optional[str],
+        locate: Callable[[], Awaitable[Optional[str]]],
+        run: Callable[[Optional[str]], Awaitable],
+    ):
+        """Result of `run` on `shard`, or on the shard `locate` tells on a miss
+
+        `run` returns None when the user is not on the shard.
+        """
+        if self.ring is None:
+            return await run(None)
+        tried = set()
+        while shard is not None and shard not in tried:
+            result = await run(shard)
+            if result is not None:
+                return result
+            tried.add(shard)
+            shard = await locate()
+
+    async def _on_shard_of(self, user_id: UUID, run):
+        async def locate():
+            return (await self._directory_shards([user_id])).get(user_id)
+
+        shard = None if self.ring is None else self.ring.shard_for(user_id)
+        return await self._run_where_found(shard, locate, run)
+
+    async def _on_shard_of_email(self, email: str, run):
+        async def locate():
+            return await self.db_session.scalar(
+                _SHARD_BY_EMAIL,
+                {"email": normalize_email(email)},
+                **_on(DIRECTORY_SHARD),
+            )
+
+        shard = None if self.ring is None else await locate()
+        return await self._run_where_found(shard, locate, run)
+
+    async def _execute_closing(
+        self, statement, params=None, shard=None, commit=False
+    ) -> list:
+        """Rows of a statement, unsharded sessions commit along with it if asked
+
+        The commit then takes no round trip of its own on psycopg connections.
+        Sharded sessions may write further shards, `_commit_sharded` ends them.
+        """
+        if self.ring is None:
+            [rows] = await execute_pipelined(
+                self.db_session, [(statement, params)], commit=commit
+            )
+            return rows
+        res = await self.db_session.execute(statement, params, **_on(shard))
+        return res.all()
+
+    def _invalidate_principals_on_commit(self, user_ids) -> None:
+        """Drops cached principals of users once the transaction commits
+
+        Dropped before, a concurrent request could cache the rows being
+        replaced again, and keep them for a whole TTL.
+        """
+        user_ids = list(user_ids)
+
+        def invalidate(session) -> None:
+            for user_id in user_ids:
+                principal_cache.invalidate(user_id)
+
+        event.listen(
+            self.db_session.sync_session, "after_commit", invalidate, once=True
+        )
+
+    async def _commit_sharded(self, commit: bool) -> None:
+        if commit and self.ring is not None:
+            await self.db_session.commit()
+
+
+class UserDAL(_ShardRouting):
+    """Data Access Layer(DAL) for operating user info"""
 
     async def create_user(
         self,
@@ -33,51 +325,418 @@ class UserDAL:
         """Method for creating new user"""
         # User parameters
         new_user = User(
+            user_id=uuid7(),
             name=name,
             surname=surname,
-            email=email,
-            hashed_password=hashed_password,
-            roles=roles,
+            email=normalize_email(email),
+            roles=encode_roles(roles),
         )
-        # Adding user info to db
+        if self.ring is not None:
+            # Claims the email first, it is unique across shards only there
+            query = insert(UserShard.__table__).values(
+                email=new_user.email,
+                user_id=new_user.user_id,
+                shard=self.ring.shard_for(new_user.user_id),
+            )
+            await self.db_session.execute(
+                _named(query, "claim_email"), **_on(DIRECTORY_SHARD)
+            )
+        # Adding user info to db, flushed to the shard of its user_id
         self.db_session.add(new_user)
         await self.db_session.flush()
+        self.db_session.add(
+            UserCredential(user_id=new_user.user_id, hashed_password=hashed_password)
+        )
+        await self.db_session.flush()
         return new_user
 
-    async def delete_user(self, user_id: UUID) -> Optional[UUID]:
-        """Method for deleting existing user"""
+    async def create_users(
+        self, users: list[dict], hashed_passwords: dict[UUID, str]
+    ) -> set[UUID]:
+        """Inserts users skipping those already existing, then their credentials"""
+        users = {
+            user["user_id"]: {**user, "email": normalize_email(user["email"])}
+            for user in users
+        }
+        if self.ring is not None:
+            query = (
+                insert(UserShard.__table__)
+                .values(
+                    [
+                        {
+                            "email": user["email"],
+                            "user_id": user_id,
+                            "shard": self.ring.shard_for(user_id),
+                        }
+                        for user_id, user in users.items()
+                    ]
+                )
+                .on_conflict_do_nothing()
+                .returning(UserShard.user_id)
+            )
+            res = await self.db_session.execute(
+                _named(query, "claim_emails"), **_on(DIRECTORY_SHARD)
+            )
+            users = {user_id: users[user_id] for user_id in res.scalars()}
+        created_user_ids = set()
+        for shard, user_ids in self._group_by_shard(users).items():
+            query = (
+                insert(User.__table__)
+                .values([users[user_id] for user_id in user_ids])
+                .on_conflict_do_nothing()
+                .returning(User.user_id)
+            )
+            res = await self.db_session.execute(
+                _named(query, "insert_users"), **_on(shard)
+            )
+            shard_created_user_ids = set(res.scalars())
+            if shard_created_user_ids:
+                query = insert(UserCredential.__table__).values(
+                    [
+                        {
+                            "user_id": user_id,
+                            "hashed_password": hashed_passwords[user_id],
+                        }
+                        for user_id in shard_created_user_ids
+                    ]
+                )
+                await self.db_session.execute(
+                    _named(query, "insert_credentials"), **_on(shard)
+                )
+            created_user_ids |= shard_created_user_ids
+        return created_user_ids
+
+    async def _write_many_if_permitted(
+        self,
+        user_ids: list[UUID],
+        permitted: ColumnElement[bool],
+        values: dict,
+        on_success=None,
+        refused: WriteOutcome = WriteOutcome.FORBIDDEN,
+        commit: bool = False,
+    ) -> dict[UUID, WriteOutcome]:
+        """Updates active users in one statement, telling why rows did not match
+
+        Users found but failing `permitted` get the `refused` outcome.
+        `on_success` builds a further statement from the CTE of updated ids,
+        it is run as part of the same statement. With shards there is a
+        statement per shard, users missing on theirs are looked up and
+        retried where the directory tells. `commit` ends the transaction.
+        """
+        users = User.__table__
+        self._invalidate_principals_on_commit(user_ids)
+        outcomes = dict.fromkeys(user_ids, WriteOutcome.NOT_FOUND)
+        pending, tried = self._group_by_shard(user_ids), set()
+        # An array instead of an IN list, lists cannot be sent in a pipeline
+        is_target = and_(
+            users.c.user_id
+            == any_(bindparam("user_ids", type_=ARRAY(UUID(as_uuid=True)))),
+            users.c.is_active == True,
+        )
+        while pending:
+            for shard, shard_user_ids in pending.items():
+                target = select(users.c.user_id).where(is_target).cte("target")
+                updated = (
+                    update(users)
+                    .where(and_(is_target, permitted))
+                    .values(values)
+                    .returning(users.c.user_id)
+                    .cte("updated")
+                )
+                query = select(target.c.user_id, updated.c.user_id).select_from(
+                    target.outerjoin(updated, target.c.user_id == updated.c.user_id)
+                )
+                if on_success is not None:
+                    query = query.add_cte(on_success(updated).cte("on_success"))
+                rows = await self._execute_closing(
+                    _named(query, "write_if_permitted"),
+                    {"user_ids": shard_user_ids},
+                    shard=shard,
+                    commit=commit,
+                )
+                for target_user_id, updated_user_id in rows:
+                    outcomes[target_user_id] = (
+                        refused if updated_user_id is None else WriteOutcome.SUCCESS
+                    )
+                tried.update((user_id, shard) for user_id in shard_user_ids)
+            missing = [
+                user_id
+                for user_id, outcome in outcomes.items()
+                if outcome == WriteOutcome.NOT_FOUND
+            ]
+            if self.ring is None or not missing:
+                break
+            pending = {}
+            for user_id, shard in (await self._directory_shards(missing)).items():
+                if (user_id, shard) not in tried:
+                    pending.setdefault(shard, []).append(user_id)
+        await self._commit_sharded(commit)
+        return outcomes
+
+    async def _write_if_permitted(
+        self, user_id: UUID, permitted: ColumnElement[bool], values: dict, **kwargs
+    ) -> WriteOutcome:
+        outcomes = await self._write_many_if_permitted(
+            [user_id], permitted, values, **kwargs
+        )
+        return outcomes[user_id]
+
+    async def delete_user_if_permitted(
+        self, user_id: UUID, current_user, commit: bool = False
+    ) -> WriteOutcome:
+        """Deactivates a user if the rules of the current user's roles allow it"""
+        # Super-admins cannot delete anyone via API, themselves included
+        permitted = (
+            false() if current_user.is_superadmin else _manageable_by(current_user)
+        )
+        return await self._write_if_permitted(
+            user_id,
+            permitted,
+            {"is_active": False, "security_version": User.security_version + 1},
+            on_success=_revoke_refresh_tokens_of,
+            commit=commit,
+        )
+
+    async def update_user_if_permitted(
+        self, user_id: UUID, current_user, commit: bool = False, **kwargs
+    ) -> WriteOutcome:
+        """Updates a user if the rules of the current user's roles allow it"""
+        if "email" in kwargs:
+            kwargs["email"] = normalize_email(kwargs["email"])
+        if "roles" in kwargs:
+            kwargs["security_version"] = User.security_version + 1
+        # The directory follows a new email in the same transaction
+        moves_email = "email" in kwargs and self.ring is not None
+        outcome = await self._write_if_permitted(
+            user_id,
+            _manageable_by(current_user),
+            kwargs,
+            commit=commit and not moves_email,
+        )
+        if moves_email:
+            if outcome == WriteOutcome.SUCCESS:
+                await self._update_directory_email(user_id, kwargs["email"])
+            await self._commit_sharded(commit)
+        return outcome
+
+    async def _update_directory_email(self, user_id: UUID, email: str) -> None:
+        """Moves the directory entry to a new email, failing if that one is taken"""
+        if self.ring is None:
+            return
         query = (
-            update(User)
-            .where(and_(User.user_id == user_id, User.is_active == True))
-            .values(is_active=False)
-        ).returning(User.user_id)
-        res = await self.db_session.execute(query)
-        deleted_user_id_row = res.fetchone()
-        if deleted_user_id_row is not None:
-            return deleted_user_id_row[0]
-
-    async def get_user_by_id(self, user_id: UUID) -> Optional[User]:
-        query = select(User).where(User.user_id == user_id)
-        res = await self.db_session.execute(query)
-        user_row = res.fetchone()
-        if user_row is not None:
-            return user_row[0]
-
-    async def get_user_by_email(self, email):
-        query = select(User).where(User.email == email)
-        res = await self.db_session.execute(query)
-        user_row = res.fetchone()
-        if user_row is not None:
-            return user_row[0]
+            update(UserShard.__table__)
+            .where(UserShard.user_id == user_id)
+            .values(email=email)
+        )
+        await self.db_session.execute(
+            _named(query, "update_directory_email"), **_on(DIRECTORY_SHARD)
+        )
+
+    async def change_admin_privilege(
+        self, user_ids: list[UUID], action: AdminPrivilegeAction, commit: bool = False
+    ) -> dict[UUID, WriteOutcome]:
+        """Grants or revokes admin privileges of users with bitwise operations
+
+        Users already in the requested state get the conflict outcome, since
+        granting skips super-admins as well.
+        """
+        users = User.__table__
+        admin_bit = ROLE_BITS[PortalRole.ROLE_PORTAL_ADMIN]
+        is_admin = has_role(users.c.roles, PortalRole.ROLE_PORTAL_ADMIN)
+        if action == AdminPrivilegeAction.GRANT:
+            permitted = and_(
+                ~is_admin, ~has_role(users.c.roles, PortalRole.ROLE_PORTAL_SUPERADMIN)
+            )
+            roles = users.c.roles.op("|")(admin_bit)
+        else:
+            permitted = is_admin
+            roles = users.c.roles.op("&")(~admin_bit)
+        return await self._write_many_if_permitted(
+            user_ids,
+            permitted,
+            {"roles": roles, "security_version": User.security_version + 1},
+            refused=WriteOutcome.CONFLICT,
+            commit=commit,
+        )
+
+    async def get_user_by_id(self, user_id: UUID) -> Optional[UserRecord]:
+        async def run(shard):
+            res = await self.db_session.execute(
+                _USER_BY_ID, {"user_id": user_id}, **_on(shard)
+            )
+            user_row = res.fetchone()
+            if user_row is not None:
+                return UserRecord(*user_row)
+
+        return await self._on_shard_of(user_id, run)
+
+    async def list_users(
+        self,
+        order_by: str,
+        after: Optional[Union[UUID, str]],
+        limit: int,
+        is_active: Optional[bool] = None,
+        role: Optional[PortalRole] = None,
+        email_domain: Optional[str] = None,
+    ) -> list[UserRecord]:
+        """Page of users ordered by `order_by` column, starting past `after`
+
+        Shards return a page each, the first `limit` users of them all make
+        the page.
+        """
+        users = User.__table__
+        key = users.c[order_by]
+        if self.ring is not None and order_by == "email":
+            # Pages are merged in code point order, shards have to sort alike
+            key = key.collate("C")
+        query = _named(
+            select(*UserRecord.columns()).order_by(key).limit(limit), "list_users"
+        )
+        if after is not None:
+            query = query.where(key > after)
+        if is_active is not None:
+            query = query.where(users.c.is_active == is_active)
+        if role is not None:
+            query = query.where(has_role(users.c.roles, role))
+        if email_domain is not None:
+            query = query.where(
+                email_domain_of(users.c.email) == normalize_email(email_domain)
+            )
+        page = []
+        for shard in self.shards:
+            res = await self.db_session.execute(query, **_on(shard))
+            page.extend(UserRecord(*user_row) for user_row in res)
+        if self.ring is None:
+            return page
+        return sorted(page, key=lambda user: getattr(user, order_by))[:limit]
+
+    async def stream_users(self, columns: list[str]) -> AsyncIterator[list]:
+        """Yields rows of the given columns of all users, a fetch at a time
+
+        Rows are plain tuples read through a server-side cursor, shard after
+        shard when users are sharded.
+        """
+        users = User.__table__
+        query = (
+            select(*(users.c[column] for column in columns))
+            .order_by(users.c.user_id)
+            .execution_options(
+                yield_per=settings.USER_EXPORT_FETCH_SIZE, statement_name="stream_users"
+            )
+        )
+        for shard in self.shards:
+            result = await self.db_session.stream(query, **_on(shard))
+            async for rows in result.partitions():
+                yield rows
+
+    async def get_user_with_password_by_email(
+        self, email
+    ) -> Optional[tuple[UserRecord, str]]:
+        """The only read of password hashes, for checking login credentials"""
+
+        async def run(shard):
+            res = await self.db_session.execute(
+                _USER_WITH_PASSWORD_BY_EMAIL,
+                {"email": normalize_email(email)},
+                **_on(shard),
+            )
+            user_row = res.fetchone()
+            if user_row is not None:
+                *user, hashed_password = user_row
+                return UserRecord(*user), hashed_password
+
+        return await self._on_shard_of_email(email, run)
+
+    async def update_password(self, user_id: UUID, hashed_password: str) -> None:
+        params = {"b_user_id": user_id, "b_hashed_password": hashed_password}
+
+        async def run(shard):
+            res = await self.db_session.execute(_UPDATE_PASSWORD, params, **_on(shard))
+            return res.scalar()
+
+        await self._on_shard_of(user_id, run)
+
+    async def get_user_by_email(self, email) -> Optional[UserRecord]:
+        async def run(shard):
+            res = await self.db_session.execute(
+                _USER_BY_EMAIL, {"email": normalize_email(email)}, **_on(shard)
+            )
+            user_row = res.fetchone()
+            if user_row is not None:
+                return UserRecord(*user_row)
+
+        return await self._on_shard_of_email(email, run)
 
     async def update_user(self, user_id, **kwargs) -> Optional[UUID]:
+        if "email" in kwargs:
+            kwargs["email"] = normalize_email(kwargs["email"])
+        if "roles" in kwargs:
+            # Outdates stateless tokens carrying the previous roles
+            kwargs["security_version"] = User.security_version + 1
         query = (
             update(User)
             .where(and_(User.user_id == user_id, User.is_active == True))
             .values(kwargs)
             .returning(User.user_id)
+            .execution_options(statement_name="update_user")
         )
-        res = await self.db_session.execute(query)
-        update_user_id_row = res.fetchone()
-        if update_user_id_row is not None:
-            return update_user_id_row[0]
+
+        async def run(shard):
+            res = await self.db_session.execute(query, **_on(shard))
+            return res.scalar()
+
+        self._invalidate_principals_on_commit([user_id])
+        updated_user_id = await self._on_shard_of(user_id, run)
+        if updated_user_id is not None and "email" in kwargs:
+            await self._update_directory_email(user_id, kwargs["email"])
+        return updated_user_id
+
+
+class RefreshTokenDAL(_ShardRouting):
+    """Data Access Layer(DAL) for operating refresh tokens"""
+
+    async def create_refresh_token(
+        self, user_id: UUID, token_hash: str, expires_at: datetime, commit: bool = False
+    ) -> None:
+        """Stores a token digest next to the user, on the shard holding it
+
+        `commit` ends the transaction.
+        """
+        params = {
+            "b_token_id": uuid4(),
+            "b_user_id": user_id,
+            "b_token_hash": token_hash,
+            "b_expires_at": expires_at,
+        }
+
+        async def run(shard):
+            rows = await self._execute_closing(
+                _CREATE_REFRESH_TOKEN, params, shard=shard, commit=commit
+            )
+            return rows[0] if rows else None
+
+        await self._on_shard_of(user_id, run)
+        await self._commit_sharded(commit)
+
+    async def rotate_refresh_token(self, token_hash: str):
+        """Revokes a valid token of an active user and returns that user's row
+
+        Lookup and revocation are one statement, so a token can be used once.
+        Tokens tell no user, so with shards every shard is asked in turn.
+        """
+        for shard in self.shards:
+            res = await self.db_session.execute(
+                _ROTATE_REFRESH_TOKEN, {"b_token_hash": token_hash}, **_on(shard)
+            )
+            user_row = res.fetchone()
+            if user_row is not None:
+                return user_row
+
+    async def revoke_refresh_token(self, token_hash: str) -> bool:
+        for shard in self.shards:
+            res = await self.db_session.execute(
+                _REVOKE_REFRESH_TOKEN, {"b_token_hash": token_hash}, **_on(shard)
+            )
+            if res.fetchone() is not None:
+                return True
+        return False
@@ -1,9 +1,20 @@
+import os
+import threading
+import time
 import uuid
+from typing import Iterable
 
 from sqlalchemy import Boolean
+from sqlalchemy import CheckConstraint
 from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import false
+from sqlalchemy import ForeignKey
+from sqlalchemy import func
+from sqlalchemy import Index
+from sqlalchemy import Integer
+from sqlalchemy import literal_column
 from sqlalchemy import String
-from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base
 from strenum import StrEnum
@@ -16,6 +27,40 @@ from strenum import StrEnum
 Base = declarative_base()
 
 
+_uuid7_lock = threading.Lock()
+_uuid7_last = (0, 0)
+
+
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUID version 7 of RFC 9562
+
+    48 bits of Unix time in milliseconds lead, so new keys append to the right
+    edge of a B-tree index. The 12 bits following the version are a counter,
+    keeping ids generated in one millisecond by this process increasing.
+    """
+    global _uuid7_last
+    timestamp_ms = time.time_ns() // 1_000_000
+    with _uuid7_lock:
+        last_timestamp_ms, last_counter = _uuid7_last
+        if timestamp_ms > last_timestamp_ms:
+            # Random start leaves most of the counter range for the millisecond
+            counter = int.from_bytes(os.urandom(2), "big") & 0x3FF
+        else:
+            timestamp_ms, counter = last_timestamp_ms, last_counter + 1
+            if counter > 0xFFF:
+                timestamp_ms, counter = timestamp_ms + 1, 0
+        _uuid7_last = (timestamp_ms, counter)
+    rand_b = int.from_bytes(os.urandom(8), "big") & (1 << 62) - 1
+    return uuid.UUID(
+        int=timestamp_ms << 80 | 0x7 << 76 | counter << 64 | 0b10 << 62 | rand_b
+    )
+
+
+def normalize_email(email: str) -> str:
+    """Emails are stored and looked up lower-cased, so any casing signs in"""
+    return email.strip().lower()
+
+
 # Class with user roles
 class PortalRole(StrEnum):
     ROLE_PORTAL_USER = "ROLE_PORTAL_USER"
@@ -23,30 +68,157 @@ class PortalRole(StrEnum):
     ROLE_PORTAL_SUPERADMIN = "ROLE_PORTAL_SUPERADMIN"
 
 
+# Bit of each role in the users.roles mask, stored data depends on these values
+ROLE_BITS = {
+    PortalRole.ROLE_PORTAL_USER: 1,
+    PortalRole.ROLE_PORTAL_ADMIN: 2,
+    PortalRole.ROLE_PORTAL_SUPERADMIN: 4,
+}
+
+
+def encode_roles(roles: Iterable[PortalRole]) -> int:
+    mask = 0
+    for role in roles:
+        mask |= ROLE_BITS[role]
+    return mask
+
+
+def decode_roles(mask: int) -> list[PortalRole]:
+    return [role for role, bit in ROLE_BITS.items() if mask & bit]
+
+
+def has_role(roles_mask, role: PortalRole):
+    """SQL check of a role, the literal bit lets it match partial indexes"""
+    return roles_mask.op("&")(literal_column(str(ROLE_BITS[role]))) != 0
+
+
+def email_domain_of(email):
+    """SQL domain part of an email, literal arguments let it match its index"""
+    return func.split_part(email, literal_column("'@'"), literal_column("2"))
+
+
+class PortalRoleMixin:
+    """Role checks for anything holding a role bitmask in `roles`"""
+
+    __slots__ = ()
+
+    @property
+    def is_superadmin(self) -> bool:
+        return bool(self.roles & ROLE_BITS[PortalRole.ROLE_PORTAL_SUPERADMIN])
+
+    @property
+    def is_admin(self) -> bool:
+        return bool(self.roles & ROLE_BITS[PortalRole.ROLE_PORTAL_ADMIN])
+
+    @property
+    def role_names(self) -> list[PortalRole]:
+        return decode_roles(self.roles)
+
+
 # SQLAlchemy Model User for interaction with database
-class User(Base):
+class User(Base, PortalRoleMixin):
     __tablename__ = "users"
 
-    user_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Ids of version 4 created before keep working, only new ones are time-ordered
+    user_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     name = Column(String, nullable=False)
     surname = Column(String, nullable=False)
     email = Column(String, nullable=False, unique=True)
     is_active = Column(Boolean, default=True)
+    # Bitmask of ROLE_BITS
+    roles = Column(Integer, nullable=False)
+    # Bumped whenever roles or status change to outdate stateless tokens
+    security_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # Keeps the plain unique index on email usable for case-insensitive lookups
+        CheckConstraint("email = lower(email)", name="ck_users_email_lowercase"),
+        # Keyset pages of the users of one email domain
+        Index("ix_users_email_domain", email_domain_of(email), email),
+        # Privileged users are few, so each of their roles gets a partial index
+        Index(
+            "ix_users_admin",
+            user_id,
+            postgresql_where=has_role(roles, PortalRole.ROLE_PORTAL_ADMIN),
+        ),
+        Index(
+            "ix_users_superadmin",
+            user_id,
+            postgresql_where=has_role(roles, PortalRole.ROLE_PORTAL_SUPERADMIN),
+        ),
+    )
+
+
+class UserRecord(PortalRoleMixin):
+    """Read-only user built from a Core row, skipping ORM instance bookkeeping"""
+
+    __slots__ = (
+        "user_id",
+        "name",
+        "surname",
+        "email",
+        "is_active",
+        "roles",
+        "security_version",
+    )
+
+    def __init__(
+        self,
+        user_id: uuid.UUID,
+        name: str,
+        surname: str,
+        email: str,
+        is_active: bool,
+        roles: int,
+        security_version: int,
+    ) -> None:
+        self.user_id = user_id
+        self.name = name
+        self.surname = surname
+        self.email = email
+        self.is_active = is_active
+        self.roles = roles
+        self.security_version = security_version
+
+    @classmethod
+    def columns(cls) -> list:
+        """Columns of users to select for building records from their rows"""
+        return [User.__table__.c[name] for name in cls.__slots__]
+
+
+# Password hash kept apart, so the users rows read on every request stay narrow
+class UserCredential(Base):
+    __tablename__ = "user_credentials"
+
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.user_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
     hashed_password = Column(String, nullable=False)
-    roles = Column(ARRAY(String), nullable=False)
 
-    @property
-    def is_superadmin(self) -> bool:
-        return PortalRole.ROLE_PORTAL_SUPERADMIN in self.roles
 
-    @property
-    def is_admin(self) -> bool:
-        return PortalRole.ROLE_PORTAL_ADMIN in self.roles
+# SQLAlchemy Model for rotating refresh tokens, only their digests are stored
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    token_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("users.user_id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    token_hash = Column(String, nullable=False, unique=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    revoked = Column(Boolean, nullable=False, default=False, server_default=false())
+
 
-    def add_admin_privileges_to_model(self) -> set:
-        if not self.is_admin:
-            return {*self.roles, PortalRole.ROLE_PORTAL_ADMIN}
+# Where each user lives when users are sharded, kept in the directory database
+# only. Emails are unique across shards by its primary key
+class UserShard(Base):
+    __tablename__ = "user_shards"
 
-    def remove_admin_privileges_from_model(self) -> set:
-        if self.is_admin:
-            return {role for role in self.roles if role != PortalRole.ROLE_PORTAL_ADMIN}
+    email = Column(String, primary_key=True)
+    user_id = Column(UUID(as_uuid=True), nullable=False, unique=True)
+    shard = Column(String, nullable=False)
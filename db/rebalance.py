@@ -0,0 +1,152 @@
+"""Moves users to the shards the hash ring assigns them, while serving traffic
+
+Run after changing SHARD_DATABASE_URLS, once the new shards are migrated,
+from the project root:
+
+    APP_PORT=8000 SENTRY_URL= python -m db.rebalance
+
+Users missing in the directory, as when sharding a single database, are
+registered in it first. Then each misplaced user is moved on its own: its
+rows are locked on the shard holding them, copied to the target shard, the
+directory is pointed there and the rows are deleted from the source. Reads
+keep finding the source copy until then, writers waiting for the lock find
+the user gone and ask the directory again. A run stopped midway is finished
+by the next one, since copies overwrite what an earlier attempt left.
+"""
+import argparse
+import asyncio
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import settings
+from db.models import RefreshToken
+from db.models import User
+from db.models import UserCredential
+from db.models import UserShard
+from db.session import engine
+from db.session import HashRing
+from db.session import shard_engines
+
+# Tables of the rows moved along with a user, referenced ones first
+USER_TABLES = [User.__table__, UserCredential.__table__, RefreshToken.__table__]
+
+
+def _upsert(table, rows: list[dict]):
+    query = insert(table).values(rows)
+    return query.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns),
+        set_={
+            column.name: query.excluded[column.name]
+            for column in table.columns
+            if not column.primary_key
+        },
+    )
+
+
+async def move_user(
+    user_id: UUID,
+    source: AsyncEngine,
+    target: AsyncEngine,
+    target_shard: str,
+    directory: AsyncEngine,
+) -> bool:
+    """Moves a user's rows between shards, False when it is not on the source"""
+    async with source.begin() as source_connection:
+        users = User.__table__
+        # Held until the rows are deleted, so no write to them gets lost
+        locked = await source_connection.scalar(
+            select(users.c.user_id).where(users.c.user_id == user_id).with_for_update()
+        )
+        if locked is None:
+            return False
+        rows = {}
+        for table in USER_TABLES:
+            res = await source_connection.execute(
+                select(table).where(table.c.user_id == user_id)
+            )
+            rows[table] = [dict(row) for row in res.mappings()]
+        async with target.begin() as target_connection:
+            for table in USER_TABLES:
+                if rows[table]:
+                    await target_connection.execute(_upsert(table, rows[table]))
+        async with directory.begin() as directory_connection:
+            await directory_connection.execute(
+                update(UserShard.__table__)
+                .where(UserShard.user_id == user_id)
+                .values(shard=target_shard)
+            )
+        # Credentials and refresh tokens go along by cascade
+        await source_connection.execute(delete(users).where(users.c.user_id == user_id))
+    return True
+
+
+async def _register(
+    directory: AsyncEngine, shard: str, users: list[tuple[UUID, str]]
+) -> None:
+    async with directory.begin() as directory_connection:
+        await directory_connection.execute(
+            insert(UserShard.__table__)
+            .values(
+                [
+                    {"email": email, "user_id": user_id, "shard": shard}
+                    for user_id, email in users
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+
+
+async def rebalance(
+    directory: AsyncEngine,
+    shards: dict[str, AsyncEngine],
+    ring: HashRing,
+    batch_size: int,
+) -> int:
+    """Moves every user not on its ring shard there, returns how many moved"""
+    users = User.__table__
+    moved = 0
+    for shard, shard_engine in shards.items():
+        after: Optional[UUID] = None
+        while True:
+            query = (
+                select(users.c.user_id, users.c.email)
+                .order_by(users.c.user_id)
+                .limit(batch_size)
+            )
+            if after is not None:
+                query = query.where(users.c.user_id > after)
+            async with shard_engine.connect() as connection:
+                batch = (await connection.execute(query)).all()
+            if not batch:
+                break
+            after = batch[-1].user_id
+            await _register(directory, shard, batch)
+            for user_id, _ in batch:
+                target_shard = ring.shard_for(user_id)
+                if target_shard != shard and await move_user(
+                    user_id, shard_engine, shards[target_shard], target_shard, directory
+                ):
+                    moved += 1
+    return moved
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    if not shard_engines:
+        parser.error("SHARD_DATABASE_URLS is not set")
+
+    ring = HashRing(shard_engines, settings.SHARD_RING_VNODES)
+    moved = await rebalance(engine, shard_engines, ring, args.batch_size)
+    print(f"Moved {moved} users")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,26 +1,497 @@
+import bisect
+import hashlib
+import itertools
+import random
+import time
+from logging import getLogger
 from typing import Generator
+from typing import Iterable
+from typing import Optional
+from uuid import UUID
+from uuid import uuid4
 
+import psycopg
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from sqlalchemy import event
+from sqlalchemy import make_url
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import Select
+from sqlalchemy.sql import visitors
 
 import settings
 
+logger = getLogger(__name__)
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent getting a connection from the pool, including opening it",
+)
+DB_POOL_SIZE = Gauge("db_pool_size", "Connections the pool keeps open", ["engine"])
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Connections currently checked out of the pool", ["engine"]
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Connections currently opened above the pool size", ["engine"]
+)
+DB_SLOW_QUERIES = Counter(
+    "db_slow_queries_total", "Statements slower than SLOW_QUERY_THRESHOLD_MS"
+)
+DB_COMPILED_CACHE = Counter(
+    "db_compiled_cache_total",
+    "Statements executed by whether their SQL came from the compiled cache, "
+    "labelled by the statement_name execution option the DAL gives them",
+    ["statement", "outcome"],
+)
+DB_REPLICA_FALLBACKS = Counter(
+    "db_replica_fallbacks_total",
+    "Reads sent to the primary because a replica could not be connected",
+)
+
 
 ##############################################
 # BLOCK FOR COMMON INTERACTION WITH DATABASE #
 ##############################################
 
 
+class _TimedCheckout:
+    """Pool mixin measuring how long checkouts wait for a connection"""
+
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started_at)
+
+
+class InstrumentedAsyncPool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+class InstrumentedNullPool(_TimedCheckout, NullPool):
+    """Opens a connection per checkout, PgBouncer pools them instead"""
+
+
+def _log_if_slow(statement: str, started_at: float) -> None:
+    duration_ms = (time.perf_counter() - started_at) * 1000
+    if duration_ms < settings.SLOW_QUERY_THRESHOLD_MS:
+        return
+    DB_SLOW_QUERIES.inc()
+    # Sampling keeps logging cheap when the database slows down as a whole
+    if random.random() < settings.SLOW_QUERY_LOG_SAMPLE_RATE:
+        # Parameters are left out, they may hold personal data
+        logger.warning("Slow query took %.1fms: %s", duration_ms, statement)
+
+
+def _log_slow_queries(engine: AsyncEngine) -> None:
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def log_if_slow(conn, cursor, statement, parameters, context, executemany):
+        _log_if_slow(statement, conn.info["query_started_at"].pop())
+
+
+def _count_compiled_cache(engine: AsyncEngine) -> None:
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        DB_COMPILED_CACHE.labels(
+            # ORM flushes and statements of other modules are not named
+            context.execution_options.get("statement_name", "other"),
+            context.cache_hit.name.lower(),
+        ).inc()
+
+
+def _export_pool_metrics(engine: AsyncEngine, name: str) -> None:
+    # Read through the engine, disposing of it replaces its pool
+    DB_POOL_SIZE.labels(name).set_function(lambda: engine.sync_engine.pool.size())
+    DB_POOL_CHECKED_OUT.labels(name).set_function(
+        lambda: engine.sync_engine.pool.checkedout()
+    )
+    # Overflow counts up from minus pool size while the pool is being filled
+    DB_POOL_OVERFLOW.labels(name).set_function(
+        lambda: max(engine.sync_engine.pool.overflow(), 0)
+    )
+
+
+def _unique_statement_name() -> str:
+    return f"__asyncpg_{uuid4()}__"
+
+
+def _connect_args(driver: str) -> dict:
+    """Driver options, keeping no prepared statements behind PgBouncer
+
+    In transaction pooling mode a client gets any server connection for each
+    transaction, where statements prepared by others under the same name may
+    exist and its own ones may not.
+    """
+    statement_cache_size = (
+        0 if settings.DB_PGBOUNCER else settings.DB_STATEMENT_CACHE_SIZE
+    )
+    if driver == "asyncpg":
+        connect_args = {"prepared_statement_cache_size": statement_cache_size}
+        if settings.DB_PGBOUNCER:
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_name_func"] = _unique_statement_name
+        return connect_args
+    # Text comes back decoded whatever the server encoding, as with asyncpg
+    connect_args = {"client_encoding": "utf8"}
+    # psycopg prepares statements once run a few times on a connection
+    if not statement_cache_size:
+        connect_args["prepare_threshold"] = None
+    return connect_args
+
+
+def create_engine_from_settings(
+    url: str, driver: Optional[str] = None, name: Optional[str] = None
+) -> AsyncEngine:
+    """Creates async engine with pool and driver options from settings
+
+    The driver in the URL is replaced by `driver`, DB_DRIVER by default.
+    Pool gauges of the engine are labelled by `name`, host and database of
+    the URL by default.
+    """
+    url = make_url(url)
+    driver = driver or settings.DB_DRIVER
+    if settings.DB_PGBOUNCER:
+        pool_args = {"poolclass": InstrumentedNullPool}
+    else:
+        pool_args = {
+            "poolclass": InstrumentedAsyncPool,
+            "pool_size": settings.DB_POOL_SIZE,
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+            "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+        }
+    new_engine = create_async_engine(
+        url.set(drivername=f"postgresql+{driver}"),
+        future=True,
+        echo=settings.DB_ECHO,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        query_cache_size=settings.DB_COMPILED_CACHE_SIZE,
+        connect_args=_connect_args(driver),
+        **pool_args,
+    )
+    _log_slow_queries(new_engine)
+    _count_compiled_cache(new_engine)
+    # PgBouncer reports its pools itself, NullPool keeps no connections
+    if not settings.DB_PGBOUNCER:
+        _export_pool_metrics(new_engine, name or f"{url.host}/{url.database}")
+    return new_engine
+
+
+def _render_for_pipeline(
+    connection: AsyncConnection, statement, params: Optional[dict]
+) -> tuple[str, dict]:
+    """SQL and parameters of a statement, rendered through the public compile API
+
+    Parameters go through the bind processors of their types. The compiled
+    cache is not used and Python-side column defaults are not computed, so
+    statements sent in a pipeline name every column having one.
+    """
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect, column_keys=sorted(params or ()))
+    if compiled.insert_prefetch or compiled.update_prefetch:
+        raise ValueError("Pipelined statements cannot rely on Python-side defaults")
+    values = compiled.construct_params(params)
+    for key, value in values.items():
+        bind = compiled.binds[key]
+        if bind.expanding or bind.literal_execute:
+            # Rendered at execution time, pass lists as arrays instead
+            raise ValueError("Pipelined statements cannot have expanding parameters")
+        processor = bind.type.dialect_impl(dialect).bind_processor(dialect)
+        if processor is not None:
+            values[key] = processor(value)
+    return compiled.string, values
+
+
+async def execute_pipelined(
+    session: AsyncSession,
+    statements: list[tuple],
+    commit: bool = False,
+    shard: Optional[str] = None,
+) -> list[list[tuple]]:
+    """Runs statements with their parameters in turn, committing if asked
+
+    With psycopg they are sent in pipeline mode along with the commit, and
+    replies are read once everything is sent, so the whole flow takes one
+    round trip. They skip the execution events of SQLAlchemy then, so the
+    pipeline is timed for the slow query log as a whole and its statements
+    are counted as compiled without the cache. Other drivers run them one
+    by one. Rows of every statement come back in order.
+    """
+    bind_arguments = None if shard is None else {"shard_id": shard}
+    connection = await session.connection(bind_arguments=bind_arguments)
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+    if not isinstance(driver_connection, psycopg.AsyncConnection):
+        results = []
+        for statement, params in statements:
+            res = await session.execute(
+                statement, params, bind_arguments=bind_arguments
+            )
+            results.append(res.all() if res.returns_rows else [])
+        if commit:
+            await session.commit()
+        return results
+    rendered = [
+        _render_for_pipeline(connection, statement, params)
+        for statement, params in statements
+    ]
+    started_at = time.perf_counter()
+    try:
+        async with driver_connection.pipeline():
+            cursors = [
+                await driver_connection.execute(query, values)
+                for query, values in rendered
+            ]
+            if commit:
+                await driver_connection.commit()
+        results = [
+            await cursor.fetchall() if cursor.description else [] for cursor in cursors
+        ]
+    except psycopg.Error as err:
+        # Raised as by SQLAlchemy, e.g. IntegrityError for unique violations
+        raise DBAPIError.instance(None, None, err, psycopg.Error) from err
+    _log_if_slow("; ".join(query for query, _ in rendered), started_at)
+    for statement, _ in statements:
+        DB_COMPILED_CACHE.labels(
+            statement.get_execution_options().get("statement_name", "other"),
+            "caching_disabled",
+        ).inc()
+    if commit:
+        # Nothing left to send, it only ends the transaction of the session
+        await session.commit()
+    return results
+
+
+class ReplicaSet:
+    """Replica engines taken in turns, skipping those that recently failed"""
+
+    def __init__(self, engines: list[Engine], retry_seconds: float) -> None:
+        self.engines = engines
+        self.retry_seconds = retry_seconds
+        self._down_until: dict[Engine, float] = {}
+        self._turns = itertools.cycle(engines)
+
+    def pick(self) -> Optional[Engine]:
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            replica = next(self._turns)
+            if self._down_until.get(replica, 0.0) <= now:
+                return replica
+        return None
+
+    def mark_down(self, replica: Engine) -> None:
+        logger.warning("Replica %s is unavailable", replica.url)
+        self._down_until[replica] = time.monotonic() + self.retry_seconds
+
+
+def _is_write(clause) -> bool:
+    if clause is None or not isinstance(clause, Select):
+        # Text and DML statements, and flushes, which pass no clause
+        return True
+    if clause._for_update_arg is not None:
+        return True
+    # Selects may modify rows in their CTEs
+    return any(
+        getattr(element, "is_dml", False) for element in visitors.iterate(clause)
+    )
+
+
+class RoutingSession(Session):
+    """Sends reads to replicas and everything else to the primary
+
+    A transaction reads from one replica picked on its first read, so its
+    reads never see replicas lagging apart. Once a session wrote, it stays
+    on the primary, so a request reads its own writes. Reads failing to
+    connect to a replica are retried on the primary, and the replica is
+    skipped for a while.
+    """
+
+    def __init__(self, *args, primary: Engine, replicas: ReplicaSet, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.primary = primary
+        self.replicas = replicas
+        event.listen(self, "after_transaction_end", self._forget_replica)
+
+    def _forget_replica(self, session, transaction) -> None:
+        # Ends with the outermost transaction, committed or rolled back
+        if transaction.parent is None:
+            self.info.pop("replica", None)
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if self.info.get("use_primary") or self._flushing or _is_write(clause):
+            self.info["use_primary"] = True
+            return self.primary
+        if "replica" not in self.info:
+            self.info["replica"] = self.replicas.pick()
+        replica = self.info["replica"]
+        self.info["read_from"] = replica
+        return replica if replica is not None else self.primary
+
+    def _execute_internal(self, statement, *args, **kwargs):
+        self.info["read_from"] = None
+        try:
+            return super()._execute_internal(statement, *args, **kwargs)
+        except (OSError, DBAPIError) as err:
+            replica = self.info["read_from"]
+            # Only a failed connect leaves nothing to roll back on the replica
+            if replica is None or (
+                isinstance(err, DBAPIError) and err.statement is not None
+            ):
+                raise
+            self.replicas.mark_down(replica)
+            DB_REPLICA_FALLBACKS.inc()
+            self.info["use_primary"] = True
+            return super()._execute_internal(statement, *args, **kwargs)
+
+
+def _ring_hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of user ids over shard names
+
+    Every shard owns `vnodes` points of the ring and a user belongs to the
+    first point following the hash of its id. Adding a shard moves about
+    1/N of the users, all of them to the new shard.
+    """
+
+    def __init__(self, shards: Iterable[str], vnodes: int) -> None:
+        self.shards = sorted(shards)
+        points = sorted(
+            (_ring_hash(f"{shard}#{index}".encode()), shard)
+            for shard in self.shards
+            for index in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, user_id: UUID) -> str:
+        # Ids are hashed, the leading bits of uuid7 are a timestamp
+        index = bisect.bisect(self._hashes, _ring_hash(user_id.bytes))
+        return self._owners[index % len(self._owners)]
+
+
+# Shard name of the database holding the email directory
+DIRECTORY_SHARD = "directory"
+
+
+class UserShardedSession(ShardedSession):
+    """Session spreading users over shards, besides the directory database
+
+    Users live with their credentials and refresh tokens on the shard of
+    their user_id. DAL statements name their shard in bind arguments, new
+    instances are placed by their user_id and ORM statements naming no
+    shard run on every user shard.
+    """
+
+    def __init__(self, *args, ring: HashRing, **kwargs):
+        super().__init__(
+            *args,
+            shard_chooser=self._choose_shard,
+            identity_chooser=self._choose_identity_shards,
+            execute_chooser=self._choose_execute_shards,
+            **kwargs,
+        )
+        self.ring = ring
+
+    def _choose_shard(self, mapper, instance, clause=None, **kwargs) -> str:
+        if instance is None:
+            raise ValueError("Statements on sharded users need a shard_id")
+        return self.ring.shard_for(instance.user_id)
+
+    def _choose_identity_shards(self, mapper, primary_key, **kwargs) -> list[str]:
+        return self.ring.shards
+
+    def _choose_execute_shards(self, orm_context) -> list[str]:
+        return self.ring.shards
+
+
+def create_sessionmaker(
+    primary: AsyncEngine, replicas: list[AsyncEngine]
+) -> sessionmaker:
+    """Sessions of the primary, routing reads to replicas when there are any"""
+    if not replicas:
+        return sessionmaker(primary, expire_on_commit=False, class_=AsyncSession)
+    return sessionmaker(
+        expire_on_commit=False,
+        class_=AsyncSession,
+        sync_session_class=RoutingSession,
+        primary=primary.sync_engine,
+        replicas=ReplicaSet(
+            [replica.sync_engine for replica in replicas],
+            retry_seconds=settings.DB_REPLICA_RETRY_SECONDS,
+        ),
+    )
+
+
+def create_sharded_sessionmaker(
+    directory: AsyncEngine, shards: dict[str, AsyncEngine]
+) -> sessionmaker:
+    """Sessions of user shards and of the directory database"""
+    if DIRECTORY_SHARD in shards:
+        raise ValueError(f"Shard name {DIRECTORY_SHARD} is reserved")
+    return sessionmaker(
+        expire_on_commit=False,
+        class_=AsyncSession,
+        sync_session_class=UserShardedSession,
+        shards={
+            DIRECTORY_SHARD: directory.sync_engine,
+            **{name: shard.sync_engine for name, shard in shards.items()},
+        },
+        ring=HashRing(shards, settings.SHARD_RING_VNODES),
+    )
+
+
 # Create async session for interaction with database
-engine = create_async_engine(settings.REAL_DATABASE_URL, future=True, echo=True)
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+engine = create_engine_from_settings(settings.REAL_DATABASE_URL, name="primary")
+# Engines of user shards, a shard in the directory database shares its engine
+shard_engines = {
+    name: engine
+    if url == settings.REAL_DATABASE_URL
+    else create_engine_from_settings(url, name=f"shard-{name}")
+    for name, url in settings.SHARD_DATABASE_URLS.items()
+}
+if shard_engines:
+    async_session = create_sharded_sessionmaker(engine, shard_engines)
+else:
+    replica_engines = [
+        create_engine_from_settings(url, name=f"replica-{index}")
+        for index, url in enumerate(settings.REPLICA_DATABASE_URLS)
+    ]
+    async_session = create_sessionmaker(engine, replica_engines)
 
 
 async def get_db() -> Generator:
-    """Dependency for getting async session"""
+    """Dependency for getting async session, the unit of work of a request
+
+    Every DAL call of the request joins the one transaction the session begins
+    on first use. Writing actions commit it before the response is sent, what
+    is left gets committed at the end and errors roll it back.
+    """
+    session: AsyncSession = async_session()
     try:
-        session: AsyncSession = async_session()
         yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
     finally:
         await session.close()
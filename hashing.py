@@ -1,6 +1,57 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
 from passlib.context import CryptContext
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+
+import settings
+
+
+def build_pwd_context(schemes: list[str], **scheme_settings) -> CryptContext:
+    """First scheme hashes new passwords, hashes of the others need an update"""
+    return CryptContext(schemes=schemes, deprecated="auto", **scheme_settings)
+
+
+def configured_scheme_settings() -> dict:
+    return {
+        # Minimum equal to default makes weaker hashes of a scheme need an update
+        "sha256_crypt__default_rounds": settings.SHA256_CRYPT_ROUNDS,
+        "sha256_crypt__min_rounds": settings.SHA256_CRYPT_ROUNDS,
+        "bcrypt__default_rounds": settings.BCRYPT_ROUNDS,
+        "bcrypt__min_rounds": settings.BCRYPT_ROUNDS,
+        "argon2__time_cost": settings.ARGON2_TIME_COST,
+        "argon2__memory_cost": settings.ARGON2_MEMORY_COST,
+        "argon2__parallelism": settings.ARGON2_PARALLELISM,
+    }
 
-pwd_context = CryptContext(schemes=["sha256_crypt"])
+
+pwd_context = build_pwd_context(
+    settings.PASSWORD_HASH_SCHEMES, **configured_scheme_settings()
+)
+
+HASHING_QUEUE_DEPTH = Gauge(
+    "password_hashing_queue_depth",
+    "Password hashing jobs submitted to the process pool and not finished yet",
+)
+HASHING_LATENCY = Histogram(
+    "password_hashing_seconds",
+    "Time from submitting a password hashing job to getting its result",
+    ["operation"],
+)
+HASHING_REJECTIONS = Counter(
+    "password_hashing_rejections_total",
+    "Password hashing jobs rejected because the pool was saturated or too slow",
+    ["reason"],
+)
+
+
+class HashingUnavailableError(Exception):
+    """Raised when the hashing pool cannot take or finish a job in time"""
 
 
 class Hasher:
@@ -11,3 +62,86 @@ class Hasher:
     @staticmethod
     def get_password_hash(password) -> str:
         return pwd_context.hash(password)
+
+    @staticmethod
+    def verify_and_update(
+        plain_password: str, hashed_password: str
+    ) -> tuple[bool, Optional[str]]:
+        """Also returns a new hash when the stored one uses outdated settings"""
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class AsyncHasher:
+    """Runs Hasher in a process pool, so hashing never blocks the event loop"""
+
+    _executor: Optional[ProcessPoolExecutor] = None
+    _pending: int = 0
+    # Slots are released from the executor thread finishing their job
+    _pending_lock = threading.Lock()
+
+    @classmethod
+    def _get_executor(cls) -> ProcessPoolExecutor:
+        if cls._executor is None:
+            cls._executor = ProcessPoolExecutor(max_workers=settings.HASHING_POOL_SIZE)
+        return cls._executor
+
+    @classmethod
+    def _release(cls) -> None:
+        with cls._pending_lock:
+            cls._pending -= 1
+        HASHING_QUEUE_DEPTH.dec()
+
+    @classmethod
+    async def _run(cls, operation: str, func, *args):
+        # Rejects the job instead of queueing it behind an unbounded backlog
+        with cls._pending_lock:
+            if cls._pending >= settings.HASHING_QUEUE_LIMIT:
+                HASHING_REJECTIONS.labels(reason="queue_full").inc()
+                raise HashingUnavailableError("Password hashing queue is full")
+            cls._pending += 1
+        HASHING_QUEUE_DEPTH.inc()
+        try:
+            job = cls._get_executor().submit(func, *args)
+        except BaseException:
+            cls._release()
+            raise
+        # The slot is held until the job is done or dropped, a job a worker
+        # already started keeps running after a timeout and still takes a CPU
+        job.add_done_callback(lambda _: cls._release())
+        started_at = time.perf_counter()
+        try:
+            # Cancelling on timeout also drops the job if no worker picked it yet
+            return await asyncio.wait_for(
+                asyncio.wrap_future(job), timeout=settings.HASHING_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            HASHING_REJECTIONS.labels(reason="timeout").inc()
+            raise HashingUnavailableError("Password hashing timed out")
+        finally:
+            HASHING_LATENCY.labels(operation=operation).observe(
+                time.perf_counter() - started_at
+            )
+
+    @classmethod
+    async def verify_password(cls, plain_password: str, hashed_password: str) -> bool:
+        return await cls._run(
+            "verify", Hasher.verify_password, plain_password, hashed_password
+        )
+
+    @classmethod
+    async def verify_and_update(
+        cls, plain_password: str, hashed_password: str
+    ) -> tuple[bool, Optional[str]]:
+        return await cls._run(
+            "verify", Hasher.verify_and_update, plain_password, hashed_password
+        )
+
+    @classmethod
+    async def get_password_hash(cls, password) -> str:
+        return await cls._run("hash", Hasher.get_password_hash, password)
+
+    @classmethod
+    def shutdown(cls) -> None:
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
@@ -9,6 +9,7 @@ import settings
 from api.handlers import user_router
 from api.login_handler import login_router
 from api.service import service_router
+from hashing import AsyncHasher
 
 # Sentry configuration
 sentry_sdk.init(
@@ -32,6 +33,12 @@ app = FastAPI(title="learning-platform")
 app.add_middleware(PrometheusMiddleware)
 app.add_route("/metrics", handle_metrics)
 
+
+@app.on_event("shutdown")
+def shutdown_hashing_pool():
+    AsyncHasher.shutdown()
+
+
 # Create the instance for the routes
 main_api_router = APIRouter()
 
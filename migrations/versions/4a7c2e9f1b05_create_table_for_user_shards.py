@@ -0,0 +1,34 @@
+"""create table for user shards
+
+Revision ID: 4a7c2e9f1b05
+Revises: b3f5a8c2e917
+Create Date: 2026-10-18 21:05:17.318406
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4a7c2e9f1b05"
+down_revision: Union[str, None] = "b3f5a8c2e917"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_shards",
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("user_id", sa.UUID(), nullable=False),
+        sa.Column("shard", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("email"),
+        sa.UniqueConstraint("user_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("user_shards")
@@ -0,0 +1,36 @@
+"""add indexes for listing users
+
+Revision ID: 5b8e3d0c7a41
+Revises: 3c1f9a7d2b64
+Create Date: 2026-10-18 15:24:08.114302
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5b8e3d0c7a41"
+down_revision: Union[str, None] = "3c1f9a7d2b64"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_users_email_domain",
+        "users",
+        [sa.text("split_part(email, '@', 2)"), "email"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_users_roles", "users", ["roles"], unique=False, postgresql_using="gin"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_roles", table_name="users", postgresql_using="gin")
+    op.drop_index("ix_users_email_domain", table_name="users")
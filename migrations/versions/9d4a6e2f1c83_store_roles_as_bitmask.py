@@ -0,0 +1,79 @@
+"""store roles as bitmask
+
+Revision ID: 9d4a6e2f1c83
+Revises: 5b8e3d0c7a41
+Create Date: 2026-10-18 16:41:53.207718
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9d4a6e2f1c83"
+down_revision: Union[str, None] = "5b8e3d0c7a41"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Bits of db.models.ROLE_BITS as of this revision
+ROLE_BITS = {
+    "ROLE_PORTAL_USER": 1,
+    "ROLE_PORTAL_ADMIN": 2,
+    "ROLE_PORTAL_SUPERADMIN": 4,
+}
+
+
+def upgrade() -> None:
+    op.drop_index("ix_users_roles", table_name="users", postgresql_using="gin")
+    mask = " | ".join(
+        f"(CASE WHEN '{role}' = ANY(roles) THEN {bit} ELSE 0 END)"
+        for role, bit in ROLE_BITS.items()
+    )
+    op.alter_column(
+        "users",
+        "roles",
+        existing_type=postgresql.ARRAY(sa.String()),
+        type_=sa.Integer(),
+        existing_nullable=False,
+        postgresql_using=mask,
+    )
+    op.create_index(
+        "ix_users_admin",
+        "users",
+        ["user_id"],
+        unique=False,
+        postgresql_where=sa.text(f"(roles & {ROLE_BITS['ROLE_PORTAL_ADMIN']}) <> 0"),
+    )
+    op.create_index(
+        "ix_users_superadmin",
+        "users",
+        ["user_id"],
+        unique=False,
+        postgresql_where=sa.text(
+            f"(roles & {ROLE_BITS['ROLE_PORTAL_SUPERADMIN']}) <> 0"
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_superadmin", table_name="users")
+    op.drop_index("ix_users_admin", table_name="users")
+    names = ", ".join(
+        f"CASE WHEN (roles & {bit}) <> 0 THEN '{role}' END"
+        for role, bit in ROLE_BITS.items()
+    )
+    op.alter_column(
+        "users",
+        "roles",
+        existing_type=sa.Integer(),
+        type_=postgresql.ARRAY(sa.String()),
+        existing_nullable=False,
+        postgresql_using=f"array_remove(ARRAY[{names}], NULL)::varchar[]",
+    )
+    op.create_index(
+        "ix_users_roles", "users", ["roles"], unique=False, postgresql_using="gin"
+    )
@@ -0,0 +1,50 @@
+"""normalize user emails
+
+Revision ID: b3f5a8c2e917
+Revises: e1b7c94a0d26
+Create Date: 2026-10-18 19:12:44.650193
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b3f5a8c2e917"
+down_revision: Union[str, None] = "e1b7c94a0d26"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Accounts differing only in email casing have to be merged by hand first
+    duplicates = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT lower(btrim(email)) FROM users "
+                "GROUP BY lower(btrim(email)) HAVING count(*) > 1"
+            )
+        )
+        .scalars()
+        .all()
+    )
+    if duplicates:
+        raise RuntimeError(
+            f"{len(duplicates)} emails are used by several users in different "
+            f"casing, e.g. {duplicates[0]}"
+        )
+    op.execute(
+        "UPDATE users SET email = lower(btrim(email)) "
+        "WHERE email <> lower(btrim(email))"
+    )
+    op.create_check_constraint(
+        "ck_users_email_lowercase", "users", "email = lower(email)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("ck_users_email_lowercase", "users", type_="check")
@@ -0,0 +1,47 @@
+"""move password hashes to user credentials
+
+Revision ID: e1b7c94a0d26
+Revises: 9d4a6e2f1c83
+Create Date: 2026-10-18 17:55:30.482916
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e1b7c94a0d26"
+down_revision: Union[str, None] = "9d4a6e2f1c83"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_credentials",
+        sa.Column("user_id", sa.UUID(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.user_id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+    op.execute(
+        "INSERT INTO user_credentials (user_id, hashed_password) "
+        "SELECT user_id, hashed_password FROM users"
+    )
+    op.drop_column("users", "hashed_password")
+
+
+def downgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column("hashed_password", sa.String(), autoincrement=False, nullable=True),
+    )
+    op.execute(
+        "UPDATE users SET hashed_password = user_credentials.hashed_password "
+        "FROM user_credentials WHERE user_credentials.user_id = users.user_id"
+    )
+    op.alter_column("users", "hashed_password", nullable=False)
+    op.drop_table("user_credentials")
@@ -0,0 +1,30 @@
+"""add security version to users
+
+Revision ID: f4f28fd5629a
+Revises: 7e2fd203ffb4
+Create Date: 2026-10-18 10:12:40.118532
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f4f28fd5629a"
+down_revision: Union[str, None] = "7e2fd203ffb4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column("security_version", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "security_version")
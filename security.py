@@ -1,12 +1,184 @@
+import base64
+import hashlib
 import json
+import secrets
 from datetime import datetime
 from datetime import timedelta
+from functools import lru_cache
 from typing import Optional
 from uuid import UUID
 
+from jose import jwk
 from jose import jwt
+from jose import JWTError
 
 import settings
+from cache import TTLCache
+
+# Verified claims by token digest, each entry expires together with its token
+token_cache = TTLCache("access_token", maxsize=settings.TOKEN_CACHE_SIZE, ttl=0)
+
+
+class JoseBackend:
+    """JWT implementation from python-jose"""
+
+    @staticmethod
+    def prepare_key(key, algorithm: str):
+        return jwk.construct(key, algorithm)
+
+    @staticmethod
+    def encode(
+        claims: dict, key, algorithm: str, headers: Optional[dict] = None
+    ) -> str:
+        return jwt.encode(claims, key, algorithm=algorithm, headers=headers)
+
+    @staticmethod
+    def decode(token: str, key, algorithms: list[str]) -> dict:
+        return jwt.decode(token, key, algorithms=algorithms)
+
+    @staticmethod
+    def get_key_id(token: str) -> Optional[str]:
+        return jwt.get_unverified_header(token).get("kid")
+
+
+class PyJWTBackend:
+    """JWT implementation from PyJWT, errors are reraised as jose ones"""
+
+    def __init__(self) -> None:
+        import jwt as pyjwt
+        from jwt.algorithms import get_default_algorithms
+
+        self.pyjwt = pyjwt
+        self.algorithms = get_default_algorithms()
+
+    def prepare_key(self, key, algorithm: str):
+        return self.algorithms[algorithm].prepare_key(key)
+
+    def encode(
+        self, claims: dict, key, algorithm: str, headers: Optional[dict] = None
+    ) -> str:
+        return self.pyjwt.encode(claims, key, algorithm=algorithm, headers=headers)
+
+    def decode(self, token: str, key, algorithms: list[str]) -> dict:
+        try:
+            return self.pyjwt.decode(token, key, algorithms=algorithms)
+        except self.pyjwt.PyJWTError as err:
+            raise JWTError(str(err)) from err
+
+    def get_key_id(self, token: str) -> Optional[str]:
+        try:
+            return self.pyjwt.get_unverified_header(token).get("kid")
+        except self.pyjwt.PyJWTError as err:
+            raise JWTError(str(err)) from err
+
+
+JWT_BACKENDS = {
+    "jose": JoseBackend,
+    "pyjwt": PyJWTBackend,
+}
+
+
+@lru_cache
+def get_jwt_backend(name: str):
+    if name not in JWT_BACKENDS:
+        raise ValueError(f"Unknown JWT backend {name!r}")
+    return JWT_BACKENDS[name]()
+
+
+class SigningKeys:
+    """Keys prepared by a JWT backend for signing and verifying tokens"""
+
+    def __init__(
+        self,
+        signing_key,
+        key_id: Optional[str],
+        verification_keys: dict,
+        jwks: dict,
+    ) -> None:
+        self.signing_key = signing_key
+        # Put into the token header, so verifiers can pick the right public key
+        self.key_id = key_id
+        # Key ids mapped to prepared keys, including keys rotated out of signing
+        self.verification_keys = verification_keys
+        # Public keys in JSON Web Key Set format, published for other services
+        self.jwks = jwks
+
+
+def _base64url_uint(value: int) -> str:
+    return _base64url(value.to_bytes((value.bit_length() + 7) // 8, "big"))
+
+
+def _base64url(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).rstrip(b"=").decode()
+
+
+def _public_jwk(public_key, algorithm: str) -> dict:
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import Encoding
+    from cryptography.hazmat.primitives.serialization import PublicFormat
+
+    if isinstance(public_key, rsa.RSAPublicKey):
+        numbers = public_key.public_numbers()
+        required = {
+            "e": _base64url_uint(numbers.e),
+            "kty": "RSA",
+            "n": _base64url_uint(numbers.n),
+        }
+    elif isinstance(public_key, ed25519.Ed25519PublicKey):
+        raw = public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+        required = {"crv": "Ed25519", "kty": "OKP", "x": _base64url(raw)}
+    else:
+        raise ValueError(f"Unsupported key type for {algorithm}")
+    # RFC 7638 thumbprint, stable for the key and so usable as its id
+    thumbprint = hashlib.sha256(
+        json.dumps(required, separators=(",", ":"), sort_keys=True).encode()
+    ).digest()
+    return {**required, "alg": algorithm, "use": "sig", "kid": _base64url(thumbprint)}
+
+
+@lru_cache
+def get_signing_keys(backend_name: str) -> SigningKeys:
+    """Loads and prepares keys once per backend, parsing them is not cheap"""
+    backend = get_jwt_backend(backend_name)
+    if settings.ALGORITHM.startswith("HS"):
+        # Shared secrets are never published
+        key = backend.prepare_key(settings.SECRET_KEY, settings.ALGORITHM)
+        return SigningKeys(
+            signing_key=key,
+            key_id=None,
+            verification_keys={None: key},
+            jwks={"keys": []},
+        )
+
+    from cryptography.hazmat.primitives.serialization import Encoding
+    from cryptography.hazmat.primitives.serialization import load_pem_private_key
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key
+    from cryptography.hazmat.primitives.serialization import PublicFormat
+
+    with open(settings.JWT_PRIVATE_KEY_PATH, "rb") as key_file:
+        private_key_pem = key_file.read()
+    public_keys = [load_pem_private_key(private_key_pem, password=None).public_key()]
+    for public_key_path in settings.JWT_PUBLIC_KEY_PATHS:
+        with open(public_key_path, "rb") as key_file:
+            public_keys.append(load_pem_public_key(key_file.read()))
+    verification_keys = {}
+    jwks = []
+    for public_key in public_keys:
+        public_jwk = _public_jwk(public_key, settings.ALGORITHM)
+        public_key_pem = public_key.public_bytes(
+            Encoding.PEM, PublicFormat.SubjectPublicKeyInfo
+        )
+        verification_keys[public_jwk["kid"]] = backend.prepare_key(
+            public_key_pem, settings.ALGORITHM
+        )
+        jwks.append(public_jwk)
+    return SigningKeys(
+        signing_key=backend.prepare_key(private_key_pem, settings.ALGORITHM),
+        key_id=jwks[0]["kid"],
+        verification_keys=verification_keys,
+        jwks={"keys": jwks},
+    )
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -18,12 +190,51 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
             minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
         )
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(
-        to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM
+    signing_keys = get_signing_keys(settings.JWT_BACKEND)
+    encoded_jwt = get_jwt_backend(settings.JWT_BACKEND).encode(
+        to_encode,
+        signing_keys.signing_key,
+        algorithm=settings.ALGORITHM,
+        headers={"kid": signing_keys.key_id} if signing_keys.key_id else None,
     )
     return encoded_jwt
 
 
+def decode_access_token(token: str, use_cache: bool = True) -> dict:
+    """Verifies token and returns its claims, raises JWTError if it is invalid
+
+    Claims are a copy of the cached ones, callers may change them.
+    """
+    token_digest = hashlib.sha256(token.encode()).digest()
+    if use_cache:
+        payload = token_cache.get(token_digest)
+        if payload is not None:
+            return dict(payload)
+    backend = get_jwt_backend(settings.JWT_BACKEND)
+    verification_keys = get_signing_keys(settings.JWT_BACKEND).verification_keys
+    key_id = backend.get_key_id(token) if None not in verification_keys else None
+    if key_id not in verification_keys:
+        raise JWTError("Token is signed with an unknown key")
+    payload = backend.decode(
+        token, verification_keys[key_id], algorithms=[settings.ALGORITHM]
+    )
+    # Tokens without expiration are verified every time
+    if use_cache and isinstance(payload.get("exp"), (int, float)):
+        token_cache.set(token_digest, dict(payload), expires_at=payload["exp"])
+    return payload
+
+
+def hash_refresh_token(refresh_token: str) -> str:
+    """Refresh tokens are random, so a fast digest is enough to store them"""
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+def create_refresh_token() -> tuple[str, str]:
+    """Returns new opaque refresh token and its digest for storing"""
+    refresh_token = secrets.token_urlsafe(32)
+    return refresh_token, hash_refresh_token(refresh_token)
+
+
 # Making UUID serializable
 class UUIDEncoder(json.JSONEncoder):
     def default(self, obj):
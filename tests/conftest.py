@@ -15,6 +15,10 @@ from sqlalchemy.sql import text
 from starlette.testclient import TestClient
 
 import settings
+from admission import login_admission
+from db.dals import principal_cache
+from db.models import decode_roles
+from db.models import encode_roles
 from db.models import PortalRole
 from db.session import get_db
 from main import app
@@ -23,6 +27,9 @@ from security import UUIDEncoder
 
 CLEAN_TABLES = [
     "users",
+    "user_credentials",
+    "refresh_tokens",
+    "user_shards",
 ]
 
 
@@ -53,24 +60,35 @@ async def clean_tables(async_session_test):
     """Clean data in all tables before running test functions"""
     async with async_session_test() as session:
         async with session.begin():
-            for table_for_cleaning in CLEAN_TABLES:
-                await session.execute(text(f"""TRUNCATE TABLE {table_for_cleaning};"""))
+            # Single statement, since tables referenced by foreign keys
+            # cannot be truncated apart from the referencing ones
+            await session.execute(
+                text(f"""TRUNCATE TABLE {", ".join(CLEAN_TABLES)};""")
+            )
+    principal_cache.clear()
+    login_admission.store.clear()
 
 
 async def _get_test_db():
+    # Create async engine for interaction with database
+    test_engine = create_async_engine(
+        settings.TEST_DATABASE_URL, future=True, echo=True
+    )
+
+    # Create session for interaction with database
+    test_async_session = sessionmaker(
+        test_engine, expire_on_commit=False, class_=AsyncSession
+    )
+    # Same unit of work as get_db
+    session = test_async_session()
     try:
-        # Create async engine for interaction with database
-        test_engine = create_async_engine(
-            settings.TEST_DATABASE_URL, future=True, echo=True
-        )
-
-        # Create session for interaction with database
-        test_async_session = sessionmaker(
-            test_engine, expire_on_commit=False, class_=AsyncSession
-        )
-        yield test_async_session()
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
     finally:
-        pass
+        await session.close()
 
 
 @pytest.fixture(scope="function")
@@ -98,9 +116,14 @@ async def asyncpg_pool():
 async def get_user_from_database(asyncpg_pool):
     async def get_user_from_database_by_uuid(user_id: str):
         async with asyncpg_pool.acquire() as connection:
-            return await connection.fetch(
-                """SELECT * FROM users WHERE user_id = $1;""", user_id
+            users = await connection.fetch(
+                """SELECT users.*, user_credentials.hashed_password FROM users
+                LEFT JOIN user_credentials USING (user_id)
+                WHERE user_id = $1;""",
+                user_id,
             )
+        # Role bitmask as the role names it stands for
+        return [{**user, "roles": decode_roles(user["roles"])} for user in users]
 
     return get_user_from_database_by_uuid
 
@@ -117,16 +140,24 @@ async def create_user_in_database(asyncpg_pool):
         roles: list[PortalRole],
     ):
         async with asyncpg_pool.acquire() as connection:
-            return await connection.execute(
-                """INSERT INTO users VALUES ($1, $2, $3, $4, $5, $6, $7)""",
-                user_id,
-                name,
-                surname,
-                email,
-                is_active,
-                hashed_password,
-                roles,
-            )
+            async with connection.transaction():
+                await connection.execute(
+                    """INSERT INTO users (
+                        user_id, name, surname, email, is_active, roles
+                    ) VALUES ($1, $2, $3, $4, $5, $6)""",
+                    user_id,
+                    name,
+                    surname,
+                    email,
+                    is_active,
+                    encode_roles(roles),
+                )
+                return await connection.execute(
+                    """INSERT INTO user_credentials (user_id, hashed_password)
+                    VALUES ($1, $2)""",
+                    user_id,
+                    hashed_password,
+                )
 
     return create_user_in_database
 
@@ -0,0 +1,25 @@
+from uuid import uuid4
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from db.dals import UserDAL
+from db.session import create_engine_from_settings
+from db.session import DB_COMPILED_CACHE
+
+
+def _count(statement: str, outcome: str) -> float:
+    return DB_COMPILED_CACHE.labels(statement, outcome)._value.get()
+
+
+async def test_prebuilt_statement_is_compiled_once():
+    engine = create_engine_from_settings(settings.TEST_DATABASE_URL)
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    misses, hits = _count("user_by_id", "cache_miss"), _count("user_by_id", "cache_hit")
+    for _ in range(3):
+        async with session_factory() as session:
+            assert await UserDAL(session).get_user_by_id(uuid4()) is None
+    assert _count("user_by_id", "cache_miss") == misses + 1
+    assert _count("user_by_id", "cache_hit") == hits + 2
+    await engine.dispose()
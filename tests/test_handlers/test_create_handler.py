@@ -1,4 +1,5 @@
 import json
+from uuid import UUID
 
 import pytest
 
@@ -13,6 +14,24 @@ async def test_create_user(client, get_user_from_database):
     await _post_and_validate_user_data(client, user_data, get_user_from_database)
 
 
+async def test_create_users_with_time_ordered_ids(client):
+    user_ids = []
+    for index in range(3):
+        resp = client.post(
+            "/user/",
+            json={
+                "name": "Artem",
+                "surname": "Budzhak",
+                "email": f"hello{index}@example.com",
+                "password": "SamplePass",
+            },
+        )
+        assert resp.status_code == 200
+        user_ids.append(UUID(resp.json()["user_id"]))
+    assert all(user_id.version == 7 for user_id in user_ids)
+    assert user_ids == sorted(user_ids)
+
+
 async def test_create_user_duplicate_email_error(client, get_user_from_database):
     user_data = {
         "name": "Artem",
@@ -36,6 +55,24 @@ async def test_create_user_duplicate_email_error(client, get_user_from_database)
     )
 
 
+async def test_create_user_email_is_case_insensitive(client, get_user_from_database):
+    user_data = {
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": " Hello@Example.com",
+        "password": "SamplePass1!",
+    }
+    resp = client.post("/user/", json=user_data)
+    assert resp.status_code == 200
+    assert resp.json()["email"] == "hello@example.com"
+    resp = client.post("/user/", json={**user_data, "email": "HELLO@example.com"})
+    assert resp.status_code == 503
+    assert (
+        'duplicate key value violates unique constraint "users_email_key"'
+        in resp.json()["detail"]
+    )
+
+
 @pytest.mark.parametrize(
     "user_data_for_creation, expected_status_code, expected_detail",
     [
@@ -3,6 +3,7 @@ from uuid import uuid4
 import pytest
 
 from db.dals import PortalRole
+from hashing import Hasher
 from tests.conftest import create_test_auth_headers_for_user
 
 
@@ -301,3 +302,28 @@ async def test_reject_delete_superadmin(
     assert resp.json() == {"detail": "Superadmin cannot be deleted via API"}
     user_from_database = await get_user_from_database(user_for_deletion["user_id"])
     assert PortalRole.ROLE_PORTAL_SUPERADMIN in dict(user_from_database[0])["roles"]
+
+
+async def test_delete_user_revokes_refresh_tokens(client, create_user_in_database):
+    user_data = {
+        "user_id": uuid4(),
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": "lol@kek.com",
+        "hashed_password": Hasher.get_password_hash("SamplePass1!"),
+        "is_active": True,
+        "roles": [PortalRole.ROLE_PORTAL_USER],
+    }
+    await create_user_in_database(**user_data)
+    resp = client.post(
+        "/login/token",
+        data={"username": user_data["email"], "password": "SamplePass1!"},
+    )
+    refresh_token = resp.json()["refresh_token"]
+    resp = client.delete(
+        f"/user/?user_id={user_data['user_id']}",
+        headers=create_test_auth_headers_for_user(user_data["user_id"]),
+    )
+    assert resp.status_code == 200
+    resp = client.post("/login/refresh", json={"refresh_token": refresh_token})
+    assert resp.status_code == 401
@@ -0,0 +1,91 @@
+import csv
+import io
+import json
+from uuid import uuid4
+
+import pytest
+
+import settings
+from db.models import PortalRole
+from tests.conftest import create_test_auth_headers_for_user
+
+
+@pytest.fixture
+async def users_for_export(create_user_in_database):
+    users = [
+        {
+            "user_id": uuid4(),
+            "name": "Artem",
+            "surname": "Budzhak",
+            "email": f"artem{index}@example.com",
+            "is_active": True,
+            "hashed_password": "SampleHashedPass",
+            "roles": roles,
+        }
+        for index, roles in enumerate(
+            [
+                [PortalRole.ROLE_PORTAL_USER],
+                [PortalRole.ROLE_PORTAL_USER],
+                [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+            ]
+        )
+    ]
+    for user_data in users:
+        await create_user_in_database(**user_data)
+    return sorted(users, key=lambda user: str(user["user_id"]))
+
+
+async def test_export_users_ndjson(client, users_for_export, monkeypatch):
+    monkeypatch.setattr(settings, "USER_EXPORT_FETCH_SIZE", 2)
+    admin = next(user for user in users_for_export if len(user["roles"]) == 2)
+    resp = client.get(
+        "/user/export", headers=create_test_auth_headers_for_user(admin["user_id"])
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in resp.text.splitlines()] == [
+        {
+            "user_id": str(user["user_id"]),
+            "name": user["name"],
+            "surname": user["surname"],
+            "email": user["email"],
+            "is_active": user["is_active"],
+            "roles": user["roles"],
+        }
+        for user in users_for_export
+    ]
+
+
+async def test_export_users_csv(client, users_for_export):
+    admin = next(user for user in users_for_export if len(user["roles"]) == 2)
+    resp = client.get(
+        "/user/export?format=csv",
+        headers=create_test_auth_headers_for_user(admin["user_id"]),
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    assert [row["email"] for row in rows] == [
+        user["email"] for user in users_for_export
+    ]
+    assert rows[0].keys() == {
+        "user_id",
+        "name",
+        "surname",
+        "email",
+        "is_active",
+        "roles",
+    }
+    assert {row["roles"] for row in rows} == {
+        "ROLE_PORTAL_USER",
+        "ROLE_PORTAL_USER;ROLE_PORTAL_ADMIN",
+    }
+
+
+async def test_export_users_by_user(client, users_for_export):
+    user = next(user for user in users_for_export if len(user["roles"]) == 1)
+    resp = client.get(
+        "/user/export", headers=create_test_auth_headers_for_user(user["user_id"])
+    )
+    assert resp.status_code == 403
+    assert resp.json() == {"detail": "Forbidden."}
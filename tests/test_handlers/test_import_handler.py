@@ -0,0 +1,195 @@
+import json
+from uuid import uuid4
+
+import pytest
+
+import settings
+from db.models import PortalRole
+from tests.conftest import create_test_auth_headers_for_user
+
+
+@pytest.fixture
+async def admin_headers(create_user_in_database):
+    user_data = {
+        "user_id": uuid4(),
+        "name": "Admin",
+        "surname": "OfAdmins",
+        "email": "admin@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+    }
+    await create_user_in_database(**user_data)
+    return create_test_auth_headers_for_user(user_data["user_id"])
+
+
+async def test_import_users_ndjson(
+    client, admin_headers, get_user_from_database, monkeypatch
+):
+    monkeypatch.setattr(settings, "USER_IMPORT_BATCH_SIZE", 2)
+    rows = [
+        {"name": "Artem", "surname": "Budzhak", "email": "artem@example.com"},
+        {"name": "Arnold", "surname": "Schwarzenegger", "email": "arnie@example.com"},
+        {"name": "123", "surname": "Budzhak", "email": "numbers@example.com"},
+        {"name": "Artem", "surname": "Budzhak", "email": "artem@example.com"},
+        {"name": "Admin", "surname": "OfAdmins", "email": "admin@example.com"},
+    ]
+    body = "\n".join(json.dumps({**row, "password": "SamplePass1!"}) for row in rows)
+    resp = client.post(
+        "/user/import",
+        content=body + "\nnot json\n\n",
+        headers={**admin_headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    results = sorted(
+        (json.loads(line) for line in resp.text.splitlines()),
+        key=lambda result: result["line"],
+    )
+    assert [(result["line"], result["status"]) for result in results] == [
+        (1, "created"),
+        (2, "created"),
+        (3, "invalid"),
+        (4, "conflict"),
+        (5, "conflict"),
+        (6, "invalid"),
+    ]
+    assert results[2]["detail"] == "Name should contain only letters"
+    for result in results[:2]:
+        user_from_db = dict((await get_user_from_database(result["user_id"]))[0])
+        assert user_from_db["roles"] == [PortalRole.ROLE_PORTAL_USER]
+        assert user_from_db["hashed_password"] != "SamplePass1!"
+
+
+async def test_import_users_csv(client, admin_headers, get_user_from_database):
+    body = (
+        "name,surname,email,password\r\n"
+        "Artem,Budzhak,artem@example.com,SamplePass1!\r\n"
+        "Arnold,Schwarzenegger,not-an-email,SamplePass1!\r\n"
+        "Arnold,Schwarzenegger\r\n"
+    )
+    resp = client.post(
+        "/user/import",
+        content=body,
+        headers={**admin_headers, "Content-Type": "text/csv"},
+    )
+    assert resp.status_code == 200
+    results = sorted(
+        (json.loads(line) for line in resp.text.splitlines()),
+        key=lambda result: result["line"],
+    )
+    assert [(result["line"], result["status"]) for result in results] == [
+        (2, "created"),
+        (3, "invalid"),
+        (4, "invalid"),
+    ]
+    user_from_db = dict((await get_user_from_database(results[0]["user_id"]))[0])
+    assert user_from_db["email"] == "artem@example.com"
+
+
+async def test_import_users_unsupported_content_type(client, admin_headers):
+    resp = client.post(
+        "/user/import",
+        json=[{"name": "Artem"}],
+        headers=admin_headers,
+    )
+    assert resp.status_code == 415
+
+
+async def test_import_users_by_user(client, create_user_in_database):
+    user_data = {
+        "user_id": uuid4(),
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": "artem@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_USER],
+    }
+    await create_user_in_database(**user_data)
+    resp = client.post(
+        "/user/import",
+        content="{}",
+        headers={
+            **create_test_auth_headers_for_user(user_data["user_id"]),
+            "Content-Type": "application/x-ndjson",
+        },
+    )
+    assert resp.status_code == 403
+    assert resp.json() == {"detail": "Forbidden."}
+
+
+async def test_import_users_rejects_long_lines(client, admin_headers, monkeypatch):
+    monkeypatch.setattr(settings, "USER_IMPORT_MAX_LINE_BYTES", 120)
+    row = {"name": "Artem", "surname": "Budzhak", "password": "SamplePass1!"}
+    body = "\n".join(
+        [
+            json.dumps({**row, "email": "artem@example.com"}),
+            json.dumps({**row, "email": "artem" * 20 + "@example.com"}),
+            json.dumps({**row, "email": "arnie@example.com"}),
+        ]
+    )
+    # The whole body arrives as one chunk, lines are checked one by one there
+    resp = client.post(
+        "/user/import",
+        content=body,
+        headers={**admin_headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 200
+    results = sorted(
+        (json.loads(line) for line in resp.text.splitlines()),
+        key=lambda result: result["line"],
+    )
+    assert [(result["line"], result["status"]) for result in results] == [
+        (1, "created"),
+        (2, "invalid"),
+        (3, "created"),
+    ]
+    assert results[1]["detail"] == "Line is too long"
+
+
+async def test_import_users_csv_invalid_header(client, admin_headers, monkeypatch):
+    monkeypatch.setattr(settings, "USER_IMPORT_MAX_LINE_BYTES", 30)
+    body = (
+        "name,surname,email,password,comment\r\n"
+        "Artem,Budzhak,artem@example.com\r\n"
+        "Arnold,Schwarzenegger,arnie@ex.com\r\n"
+    )
+    resp = client.post(
+        "/user/import",
+        content=body,
+        headers={**admin_headers, "Content-Type": "text/csv"},
+    )
+    assert resp.status_code == 200
+    assert [json.loads(line) for line in resp.text.splitlines()] == [
+        {
+            "line": 1,
+            "status": "invalid",
+            "user_id": None,
+            "detail": "Header is invalid: Line is too long",
+        }
+    ]
+
+
+async def test_import_users_csv_quoted_line_break(client, admin_headers):
+    body = (
+        "name,surname,email,password\r\n"
+        '"Artem",Budzhak,artem@example.com,"Sample\r\nPass1!"\r\n'
+        'Arnold,Schwarzenegger,arnie@example.com,"SamplePass1!"\r\n'
+    )
+    resp = client.post(
+        "/user/import",
+        content=body,
+        headers={**admin_headers, "Content-Type": "text/csv"},
+    )
+    assert resp.status_code == 200
+    results = sorted(
+        (json.loads(line) for line in resp.text.splitlines()),
+        key=lambda result: result["line"],
+    )
+    assert [(result["line"], result["status"]) for result in results] == [
+        (2, "invalid"),
+        (3, "invalid"),
+        (4, "created"),
+    ]
+    assert results[0]["detail"] == "Quoted fields should not contain line breaks"
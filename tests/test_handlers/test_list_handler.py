@@ -0,0 +1,136 @@
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import event
+
+import settings
+from db.dals import UserDAL
+from db.models import PortalRole
+from tests.conftest import create_test_auth_headers_for_user
+
+
+@pytest.fixture
+async def users_for_listing(create_user_in_database):
+    users = [
+        {
+            "user_id": uuid4(),
+            "name": "Artem",
+            "surname": "Budzhak",
+            "email": f"artem{index}@{domain}",
+            "is_active": is_active,
+            "hashed_password": "SampleHashedPass",
+            "roles": roles,
+        }
+        for index, (domain, is_active, roles) in enumerate(
+            [
+                ("example.com", True, [PortalRole.ROLE_PORTAL_USER]),
+                ("example.com", False, [PortalRole.ROLE_PORTAL_USER]),
+                ("school.edu", True, [PortalRole.ROLE_PORTAL_USER]),
+                ("school.edu", True, [PortalRole.ROLE_PORTAL_USER]),
+                (
+                    "school.edu",
+                    True,
+                    [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+                ),
+            ]
+        )
+    ]
+    for user_data in users:
+        await create_user_in_database(**user_data)
+    return users
+
+
+def _list_all_pages(client, headers, **params):
+    pages, cursor = [], None
+    while True:
+        resp = client.get(
+            "/user/list",
+            params={**params, **({"cursor": cursor} if cursor else {})},
+            headers=headers,
+        )
+        assert resp.status_code == 200
+        data = resp.json()
+        pages.append([user["email"] for user in data["users"]])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("order_by", ["user_id", "email"])
+async def test_list_users_pages(client, users_for_listing, order_by):
+    admin = users_for_listing[-1]
+    pages = _list_all_pages(
+        client,
+        create_test_auth_headers_for_user(admin["user_id"]),
+        order_by=order_by,
+        limit=2,
+    )
+    assert [len(page) for page in pages] == [2, 2, 1]
+    expected = sorted(users_for_listing, key=lambda user: str(user[order_by]))
+    assert [email for page in pages for email in page] == [
+        user["email"] for user in expected
+    ]
+
+
+async def test_list_users_filters(client, users_for_listing):
+    headers = create_test_auth_headers_for_user(users_for_listing[-1]["user_id"])
+    pages = _list_all_pages(
+        client, headers, order_by="email", email_domain="school.edu", limit=2
+    )
+    assert pages == [
+        ["artem2@school.edu", "artem3@school.edu"],
+        ["artem4@school.edu"],
+    ]
+    pages = _list_all_pages(client, headers, is_active=False)
+    assert pages == [["artem1@example.com"]]
+    pages = _list_all_pages(client, headers, role=PortalRole.ROLE_PORTAL_ADMIN)
+    assert pages == [["artem4@school.edu"]]
+
+
+async def test_list_users_page_size_cap(client, users_for_listing):
+    resp = client.get(
+        "/user/list",
+        params={"limit": settings.USER_LIST_MAX_PAGE_SIZE + 1},
+        headers=create_test_auth_headers_for_user(users_for_listing[-1]["user_id"]),
+    )
+    assert resp.status_code == 422
+
+
+async def test_list_users_invalid_cursor(client, users_for_listing):
+    headers = create_test_auth_headers_for_user(users_for_listing[-1]["user_id"])
+    resp = client.get("/user/list", params={"limit": 1}, headers=headers)
+    cursor = resp.json()["next_cursor"]
+    for params in [{"cursor": "garbage"}, {"cursor": cursor, "order_by": "email"}]:
+        resp = client.get("/user/list", params=params, headers=headers)
+        assert resp.status_code == 422
+        assert resp.json() == {"detail": "Invalid cursor"}
+
+
+async def test_list_users_by_user(client, users_for_listing):
+    resp = client.get(
+        "/user/list",
+        headers=create_test_auth_headers_for_user(users_for_listing[0]["user_id"]),
+    )
+    assert resp.status_code == 403
+    assert resp.json() == {"detail": "Forbidden."}
+
+
+async def test_list_users_domain_filter_matches_index(async_session_test):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async with async_session_test() as session:
+        sync_engine = session.bind.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", record)
+        try:
+            await UserDAL(session).list_users(
+                "email", None, 10, email_domain="School.edu"
+            )
+        finally:
+            event.remove(sync_engine, "before_cursor_execute", record)
+    # Same expression as ix_users_email_domain, bound arguments would not match
+    # it once the prepared statement switches to a generic plan
+    [statement] = statements
+    assert "split_part(users.email, '@', 2) = " in statement
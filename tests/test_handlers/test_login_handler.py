@@ -0,0 +1,187 @@
+import asyncio
+import time
+from uuid import uuid4
+
+import pytest
+from passlib.hash import sha256_crypt
+
+import settings
+from db.models import PortalRole
+from hashing import AsyncHasher
+from hashing import Hasher
+from hashing import HashingUnavailableError
+from hashing import pwd_context
+
+
+async def _create_user_and_login(client, create_user_in_database) -> tuple:
+    user_data = {
+        "user_id": uuid4(),
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": "artem@example.com",
+        "is_active": True,
+        "hashed_password": Hasher.get_password_hash("SamplePass"),
+        "roles": [PortalRole.ROLE_PORTAL_USER],
+    }
+    await create_user_in_database(**user_data)
+    resp = client.post(
+        "/login/token",
+        data={"username": user_data["email"], "password": "SamplePass"},
+    )
+    assert resp.status_code == 200
+    return user_data, resp.json()
+
+
+async def test_login_email_is_case_insensitive(client, create_user_in_database):
+    await _create_user_and_login(client, create_user_in_database)
+    resp = client.post(
+        "/login/token",
+        data={"username": " ArTem@Example.COM", "password": "SamplePass"},
+    )
+    assert resp.status_code == 200
+
+
+async def test_login_issues_refresh_token(client, create_user_in_database):
+    _, tokens = await _create_user_and_login(client, create_user_in_database)
+    assert tokens["token_type"] == "bearer"
+    assert tokens["access_token"]
+    assert tokens["refresh_token"]
+
+
+async def test_login_rehashes_outdated_password_hash(
+    client, create_user_in_database, get_user_from_database
+):
+    # Fewer rounds than configured, so the hash needs an update
+    outdated_hash = sha256_crypt.using(rounds=1000).hash("SamplePass")
+    assert pwd_context.needs_update(outdated_hash)
+    user_data = {
+        "user_id": uuid4(),
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": "artem@example.com",
+        "is_active": True,
+        "hashed_password": outdated_hash,
+        "roles": [PortalRole.ROLE_PORTAL_USER],
+    }
+    await create_user_in_database(**user_data)
+    resp = client.post(
+        "/login/token",
+        data={"username": user_data["email"], "password": "SamplePass"},
+    )
+    assert resp.status_code == 200
+    user_from_db = dict((await get_user_from_database(user_data["user_id"]))[0])
+    new_hash = user_from_db["hashed_password"]
+    assert new_hash != outdated_hash
+    assert not pwd_context.needs_update(new_hash)
+    assert Hasher.verify_password("SamplePass", new_hash)
+    # The updated hash keeps working for the next login
+    resp = client.post(
+        "/login/token",
+        data={"username": user_data["email"], "password": "SamplePass"},
+    )
+    assert resp.status_code == 200
+
+
+async def test_refresh_rotates_token(client, create_user_in_database):
+    user_data, tokens = await _create_user_and_login(client, create_user_in_database)
+    resp = client.post(
+        "/login/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert resp.status_code == 200
+    refreshed_tokens = resp.json()
+    assert refreshed_tokens["refresh_token"] != tokens["refresh_token"]
+    resp = client.get(
+        f"/user/?user_id={user_data['user_id']}",
+        headers={"Authorization": f"Bearer {refreshed_tokens['access_token']}"},
+    )
+    assert resp.status_code == 200
+    # Used refresh token cannot be replayed
+    resp = client.post(
+        "/login/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert resp.status_code == 401
+    assert resp.json() == {"detail": "Invalid refresh token"}
+
+
+async def test_refresh_with_revoked_token(client, create_user_in_database):
+    _, tokens = await _create_user_and_login(client, create_user_in_database)
+    resp = client.post("/login/revoke", json={"refresh_token": tokens["refresh_token"]})
+    assert resp.status_code == 200
+    assert resp.json() == {"revoked": True}
+    resp = client.post(
+        "/login/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert resp.status_code == 401
+    assert resp.json() == {"detail": "Invalid refresh token"}
+
+
+async def test_refresh_with_unknown_token(client):
+    resp = client.post("/login/refresh", json={"refresh_token": "unknown"})
+    assert resp.status_code == 401
+    assert resp.json() == {"detail": "Invalid refresh token"}
+
+
+async def test_login_rate_limited_per_email(client, monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_BURST_PER_EMAIL", 1)
+    form_data = {"username": "artem@example.com", "password": "WrongPass"}
+    resp = client.post("/login/token", data=form_data)
+    assert resp.status_code == 401
+    resp = client.post("/login/token", data=form_data)
+    assert resp.status_code == 429
+    assert resp.json() == {"detail": "Too many login attempts"}
+    assert int(resp.headers["Retry-After"]) >= 1
+
+
+@pytest.mark.parametrize(
+    "setting, value, detail",
+    [
+        ("HASHING_QUEUE_LIMIT", 0, "Password hashing queue is full"),
+        ("HASHING_TIMEOUT_SECONDS", 0, "Password hashing timed out"),
+    ],
+)
+async def test_login_hashing_unavailable(
+    client, create_user_in_database, monkeypatch, setting, value, detail
+):
+    user_data = {
+        "user_id": uuid4(),
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": "artem@example.com",
+        "is_active": True,
+        "hashed_password": Hasher.get_password_hash("SamplePass"),
+        "roles": [PortalRole.ROLE_PORTAL_USER],
+    }
+    await create_user_in_database(**user_data)
+    monkeypatch.setattr(settings, setting, value)
+    resp = client.post(
+        "/login/token",
+        data={"username": user_data["email"], "password": "SamplePass"},
+    )
+    assert resp.status_code == 503
+    assert resp.json() == {"detail": detail}
+
+
+async def _wait_for_pending(count: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while AsyncHasher._pending != count:
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.05)
+
+
+async def test_hashing_timeout_holds_slot_until_job_ends(monkeypatch):
+    # Jobs left over by earlier tests finish first, none of them is counted then
+    await _wait_for_pending(0)
+    # Own pool, so no job of another test runs next to the one of this test
+    monkeypatch.setattr(AsyncHasher, "_executor", None)
+    try:
+        # Warms the pool up, so the next job is picked by a worker right away
+        assert await AsyncHasher._run("hash", abs, -1) == 1
+        await _wait_for_pending(0)
+        monkeypatch.setattr(settings, "HASHING_TIMEOUT_SECONDS", 0.2)
+        with pytest.raises(HashingUnavailableError):
+            await AsyncHasher._run("hash", time.sleep, 1)
+        # The started job cannot be cancelled and still counts against the limit
+        assert AsyncHasher._pending == 1
+        await _wait_for_pending(0)
+    finally:
+        AsyncHasher.shutdown()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from db.dals import RefreshTokenDAL
+from db.dals import UserDAL
+from db.dals import WriteOutcome
+from db.models import PortalRole
+from db.session import _connect_args
+from db.session import _unique_statement_name
+from db.session import create_engine_from_settings
+from db.session import InstrumentedNullPool
+
+TEST_PGBOUNCER_DATABASE_URL = os.environ.get("TEST_PGBOUNCER_DATABASE_URL")
+
+
+@pytest.fixture
+def pgbouncer_mode(monkeypatch):
+    monkeypatch.setattr(settings, "DB_PGBOUNCER", True)
+
+
+def test_asyncpg_keeps_no_prepared_statements(pgbouncer_mode):
+    connect_args = _connect_args("asyncpg")
+    assert connect_args["statement_cache_size"] == 0
+    assert connect_args["prepared_statement_cache_size"] == 0
+    name_func = connect_args["prepared_statement_name_func"]
+    assert name_func is _unique_statement_name
+    # Names never clash with statements other clients left on a server
+    assert name_func() != name_func()
+
+
+def test_psycopg_prepares_no_statements(pgbouncer_mode):
+    assert _connect_args("psycopg")["prepare_threshold"] is None
+
+
+@pytest.mark.parametrize("driver", ["asyncpg", "psycopg"])
+async def test_pgbouncer_mode_round_trip(pgbouncer_mode, driver):
+    engine = create_engine_from_settings(settings.TEST_DATABASE_URL, driver=driver)
+    # PgBouncer pools server connections, the app keeps none
+    assert isinstance(engine.sync_engine.pool, InstrumentedNullPool)
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    await _serve_client_requests(session_factory)
+    await engine.dispose()
+
+
+async def _serve_client_requests(session_factory) -> None:
+    async with session_factory() as session:
+        user_dal = UserDAL(session)
+        user = await user_dal.create_user(
+            name="Artem",
+            surname="Budzhak",
+            # Unique across runs, the pgbouncer service database is not cleaned
+            email=f"artem-{uuid4()}@example.com",
+            hashed_password="SampleHashedPass",
+            roles=[PortalRole.ROLE_PORTAL_USER],
+        )
+        await session.commit()
+        for _ in range(3):
+            current_user = await user_dal.get_user_by_id(user.user_id)
+            outcome = await user_dal.update_user_if_permitted(
+                user.user_id, current_user, commit=True, name="Leo"
+            )
+            assert outcome == WriteOutcome.SUCCESS
+            await RefreshTokenDAL(session).create_refresh_token(
+                user_id=user.user_id,
+                token_hash=os.urandom(16).hex(),
+                expires_at=datetime.now(timezone.utc) + timedelta(days=1),
+                commit=True,
+            )
+
+
+@pytest.mark.skipif(
+    TEST_PGBOUNCER_DATABASE_URL is None,
+    reason="TEST_PGBOUNCER_DATABASE_URL of the pgbouncer service is not set",
+)
+@pytest.mark.parametrize("driver", ["asyncpg", "psycopg"])
+async def test_pgbouncer_shares_server_connections(pgbouncer_mode, driver):
+    engine = create_engine_from_settings(TEST_PGBOUNCER_DATABASE_URL, driver=driver)
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    # Many more clients than server connections, each moving between them
+    await asyncio.gather(*(_serve_client_requests(session_factory) for _ in range(20)))
+    await engine.dispose()
@@ -0,0 +1,128 @@
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+import pytest
+from sqlalchemy import bindparam
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import String
+from sqlalchemy import TypeDecorator
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from db.dals import RefreshTokenDAL
+from db.dals import UserDAL
+from db.dals import WriteOutcome
+from db.models import PortalRole
+from db.models import RefreshToken
+from db.session import create_engine_from_settings
+from db.session import DB_SLOW_QUERIES
+from db.session import execute_pipelined
+
+
+class Reversed(TypeDecorator):
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return value[::-1]
+
+
+@pytest.fixture(params=["asyncpg", "psycopg"])
+async def session_factory(request):
+    engine = create_engine_from_settings(
+        settings.TEST_DATABASE_URL, driver=request.param
+    )
+    yield sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    await engine.dispose()
+
+
+async def _create_users(session: AsyncSession, count: int) -> list:
+    user_dal = UserDAL(session)
+    users = [
+        await user_dal.create_user(
+            name="Artem",
+            surname="Budzhak",
+            email=f"artem{index}@example.com",
+            hashed_password="SampleHashedPass",
+            roles=[
+                PortalRole.ROLE_PORTAL_ADMIN
+                if index == 0
+                else PortalRole.ROLE_PORTAL_USER
+            ],
+        )
+        for index in range(count)
+    ]
+    await session.commit()
+    return users
+
+
+async def test_write_commits_along(session_factory, get_user_from_database):
+    async with session_factory() as session:
+        admin, user = await _create_users(session, 2)
+        admin = await UserDAL(session).get_user_by_id(admin.user_id)
+        await RefreshTokenDAL(session).create_refresh_token(
+            user_id=user.user_id,
+            token_hash="digest",
+            expires_at=datetime.now(timezone.utc) + timedelta(days=1),
+            commit=True,
+        )
+        assert not session.in_transaction()
+        outcome = await UserDAL(session).delete_user_if_permitted(
+            user.user_id, admin, commit=True
+        )
+        assert outcome == WriteOutcome.SUCCESS
+        assert not session.in_transaction()
+
+    users_from_db = await get_user_from_database(user.user_id)
+    assert users_from_db[0]["is_active"] is False
+    async with session_factory() as session:
+        token = await session.scalar(select(RefreshToken))
+        # Defaults computed in Python are sent along
+        assert token.token_id is not None
+        assert token.revoked is True
+
+
+async def test_failed_write_raises_integrity_error(session_factory):
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    async with session_factory() as session:
+        [user] = await _create_users(session, 1)
+        refresh_token_dal = RefreshTokenDAL(session)
+        await refresh_token_dal.create_refresh_token(
+            user.user_id, "digest", expires_at, commit=True
+        )
+        with pytest.raises(IntegrityError):
+            await refresh_token_dal.create_refresh_token(
+                user.user_id, "digest", expires_at, commit=True
+            )
+
+
+async def test_pipeline_processes_bind_parameters(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "SLOW_QUERY_THRESHOLD_MS", 0)
+    slow_queries = DB_SLOW_QUERIES._value.get()
+    statement = select(bindparam("value", type_=Reversed))
+    async with session_factory() as session:
+        rows = await execute_pipelined(
+            session, [(statement, {"value": "abc"})], commit=True
+        )
+    assert rows == [[("cba",)]]
+    # Pipelined statements are timed as well
+    assert DB_SLOW_QUERIES._value.get() > slow_queries
+
+
+async def test_pipeline_refuses_python_defaults():
+    engine = create_engine_from_settings(settings.TEST_DATABASE_URL, driver="psycopg")
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    # token_id and revoked get their values in Python only
+    statement = insert(RefreshToken).values(
+        user_id=bindparam("b_user_id"),
+        token_hash="digest",
+        expires_at=datetime.now(timezone.utc),
+    )
+    async with session_factory() as session:
+        with pytest.raises(ValueError):
+            await execute_pipelined(session, [(statement, {"b_user_id": None})])
+    await engine.dispose()
@@ -0,0 +1,25 @@
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+
+import settings
+from db.session import create_engine_from_settings
+
+
+def _gauge(metric: str, engine: str) -> float:
+    return REGISTRY.get_sample_value(metric, {"engine": engine})
+
+
+async def test_pool_gauges_labelled_per_engine(monkeypatch):
+    monkeypatch.setattr(settings, "DB_PGBOUNCER", False)
+    engines = [
+        create_engine_from_settings(settings.TEST_DATABASE_URL, name=name)
+        for name in ("test-primary", "test-replica")
+    ]
+    async with engines[0].connect() as connection:
+        await connection.execute(text("SELECT 1"))
+        assert _gauge("db_pool_checked_out", "test-primary") == 1
+        assert _gauge("db_pool_checked_out", "test-replica") == 0
+    for name in ("test-primary", "test-replica"):
+        assert _gauge("db_pool_size", name) == settings.DB_POOL_SIZE
+    for engine in engines:
+        await engine.dispose()
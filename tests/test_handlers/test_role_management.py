@@ -1,8 +1,12 @@
+import json
+from datetime import timedelta
 from uuid import uuid4
 
 import pytest
 
 from db.models import PortalRole
+from security import create_access_token
+from security import UUIDEncoder
 from tests.conftest import create_test_auth_headers_for_user
 
 
@@ -137,3 +141,218 @@ async def test_revoke_admin_role_from_user_by_wrong_type_of_user(
     assert not_revoked_user_from_db["user_id"] == user_data_for_revoke["user_id"]
     # Check if user privilege was not revoked
     assert PortalRole.ROLE_PORTAL_ADMIN in not_revoked_user_from_db["roles"]
+
+
+async def test_revoked_admin_loses_privileges_immediately(
+    client, create_user_in_database, get_user_from_database
+):
+    user_data_for_deletion = {
+        "user_id": uuid4(),
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": "artem@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_USER],
+    }
+    user_data_for_revoke = {
+        "user_id": uuid4(),
+        "name": "Admin",
+        "surname": "OfAdmins",
+        "email": "admin@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+    }
+    user_data_who_revokes = {
+        "user_id": uuid4(),
+        "name": "Arnold",
+        "surname": "Schwarzenegger",
+        "email": "arnie@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_SUPERADMIN],
+    }
+    for user_data in [
+        user_data_for_deletion,
+        user_data_for_revoke,
+        user_data_who_revokes,
+    ]:
+        await create_user_in_database(**user_data)
+    admin_headers = create_test_auth_headers_for_user(user_data_for_revoke["user_id"])
+    # Loads the admin into the principal cache
+    resp = client.get(
+        f"/user/?user_id={user_data_for_revoke['user_id']}", headers=admin_headers
+    )
+    assert resp.status_code == 200
+    resp = client.delete(
+        f"/user/admin_privilege?user_id={user_data_for_revoke['user_id']}",
+        headers=create_test_auth_headers_for_user(user_data_who_revokes["user_id"]),
+    )
+    assert resp.status_code == 200
+    resp = client.delete(
+        f"/user/?user_id={user_data_for_deletion['user_id']}", headers=admin_headers
+    )
+    assert resp.status_code == 403
+    not_deleted_user_from_db = await get_user_from_database(
+        user_data_for_deletion["user_id"]
+    )
+    assert dict(not_deleted_user_from_db[0])["is_active"] is True
+
+
+async def test_stateless_token_outdated_by_privilege_revoke(
+    client, create_user_in_database
+):
+    user_data_for_deletion = {
+        "user_id": uuid4(),
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": "artem@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_USER],
+    }
+    user_data_for_revoke = {
+        "user_id": uuid4(),
+        "name": "Admin",
+        "surname": "OfAdmins",
+        "email": "admin@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+    }
+    user_data_who_revokes = {
+        "user_id": uuid4(),
+        "name": "Arnold",
+        "surname": "Schwarzenegger",
+        "email": "arnie@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_SUPERADMIN],
+    }
+    for user_data in [
+        user_data_for_deletion,
+        user_data_for_revoke,
+        user_data_who_revokes,
+    ]:
+        await create_user_in_database(**user_data)
+    stateless_token = create_access_token(
+        data={
+            "sub": json.dumps(user_data_for_revoke["user_id"], cls=UUIDEncoder),
+            "roles": user_data_for_revoke["roles"],
+            "active": True,
+            "ver": 0,
+        },
+        expires_delta=timedelta(minutes=5),
+    )
+    admin_headers = {"Authorization": f"Bearer {stateless_token}"}
+    # Read endpoints trust the token claims
+    resp = client.get(
+        f"/user/?user_id={user_data_for_deletion['user_id']}", headers=admin_headers
+    )
+    assert resp.status_code == 200
+    resp = client.delete(
+        f"/user/admin_privilege?user_id={user_data_for_revoke['user_id']}",
+        headers=create_test_auth_headers_for_user(user_data_who_revokes["user_id"]),
+    )
+    assert resp.status_code == 200
+    # Write endpoints compare the security version with the database
+    resp = client.delete(
+        f"/user/?user_id={user_data_for_deletion['user_id']}", headers=admin_headers
+    )
+    assert resp.status_code == 401
+    assert resp.json() == {"detail": "Could not validate credentials"}
+
+
+@pytest.mark.parametrize(
+    "action, expected_outcomes, expected_admin",
+    [
+        ("grant", ["success", "conflict", "conflict"], [True, True, False]),
+        ("revoke", ["conflict", "success", "conflict"], [False, False, False]),
+    ],
+)
+async def test_change_admin_privilege_in_bulk(
+    client,
+    create_user_in_database,
+    get_user_from_database,
+    action,
+    expected_outcomes,
+    expected_admin,
+):
+    users_for_change = [
+        {
+            "user_id": uuid4(),
+            "name": "Artem",
+            "surname": "Budzhak",
+            "email": f"artem{index}@example.com",
+            "is_active": True,
+            "hashed_password": "SampleHashedPass",
+            "roles": roles,
+        }
+        for index, roles in enumerate(
+            [
+                [PortalRole.ROLE_PORTAL_USER],
+                [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+                [PortalRole.ROLE_PORTAL_SUPERADMIN],
+            ]
+        )
+    ]
+    user_data_who_changes = {
+        "user_id": uuid4(),
+        "name": "Arnold",
+        "surname": "Schwarzenegger",
+        "email": "arnie@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_SUPERADMIN],
+    }
+    for user_data in [*users_for_change, user_data_who_changes]:
+        await create_user_in_database(**user_data)
+    missing_user_id = uuid4()
+    user_ids = [str(user_data["user_id"]) for user_data in users_for_change]
+    resp = client.post(
+        "/user/admin_privilege/bulk",
+        json={
+            "user_ids": [
+                *user_ids,
+                str(missing_user_id),
+                str(user_data_who_changes["user_id"]),
+            ],
+            "action": action,
+        },
+        headers=create_test_auth_headers_for_user(user_data_who_changes["user_id"]),
+    )
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "results": [
+            *(
+                {"user_id": user_id, "outcome": outcome}
+                for user_id, outcome in zip(user_ids, expected_outcomes)
+            ),
+            {"user_id": str(missing_user_id), "outcome": "not_found"},
+            {"user_id": str(user_data_who_changes["user_id"]), "outcome": "forbidden"},
+        ]
+    }
+    for user_data, is_admin in zip(users_for_change, expected_admin):
+        user_from_db = dict((await get_user_from_database(user_data["user_id"]))[0])
+        assert (PortalRole.ROLE_PORTAL_ADMIN in user_from_db["roles"]) is is_admin
+
+
+async def test_change_admin_privilege_in_bulk_by_admin(client, create_user_in_database):
+    user_data = {
+        "user_id": uuid4(),
+        "name": "Arnold",
+        "surname": "Schwarzenegger",
+        "email": "arnie@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+    }
+    await create_user_in_database(**user_data)
+    resp = client.post(
+        "/user/admin_privilege/bulk",
+        json={"user_ids": [str(uuid4())], "action": "grant"},
+        headers=create_test_auth_headers_for_user(user_data["user_id"]),
+    )
+    assert resp.status_code == 403
+    assert resp.json() == {"detail": "Forbidden."}
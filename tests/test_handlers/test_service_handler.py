@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.hazmat.primitives.serialization import NoEncryption
+from cryptography.hazmat.primitives.serialization import PrivateFormat
+
+import settings
+from security import create_access_token
+from security import decode_access_token
+from security import get_signing_keys
+
+
+@pytest.fixture
+def rs256_signing(tmp_path, monkeypatch):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_key_path = tmp_path / "private_key.pem"
+    private_key_path.write_bytes(
+        private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+    )
+    monkeypatch.setattr(settings, "ALGORITHM", "RS256")
+    monkeypatch.setattr(settings, "JWT_PRIVATE_KEY_PATH", str(private_key_path))
+    get_signing_keys.cache_clear()
+    yield private_key
+    get_signing_keys.cache_clear()
+
+
+async def test_ping(client):
+    resp = client.get("/ping")
+    assert resp.status_code == 200
+    assert resp.json() == {"Success": True}
+
+
+async def test_jwks_hides_shared_secret(client):
+    resp = client.get("/.well-known/jwks.json")
+    assert resp.status_code == 200
+    assert resp.json() == {"keys": []}
+
+
+async def test_jwks_publishes_signing_key(client, rs256_signing):
+    resp = client.get("/.well-known/jwks.json")
+    assert resp.status_code == 200
+    keys = resp.json()["keys"]
+    assert len(keys) == 1
+    assert keys[0]["kty"] == "RSA"
+    assert keys[0]["alg"] == "RS256"
+    access_token = create_access_token(
+        data={"sub": "user"}, expires_delta=timedelta(minutes=5)
+    )
+    assert decode_access_token(access_token, use_cache=False)["sub"] == "user"
@@ -0,0 +1,180 @@
+import os
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+import pytest
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import settings
+from db.dals import RefreshTokenDAL
+from db.dals import UserDAL
+from db.models import Base
+from db.models import PortalRole
+from db.models import User
+from db.models import UserShard
+from db.models import uuid7
+from db.rebalance import rebalance
+from db.session import create_sharded_sessionmaker
+from db.session import HashRing
+
+TEST_SHARD_DATABASE_URLS = os.environ.get("TEST_SHARD_DATABASE_URLS")
+
+requires_shards = pytest.mark.skipif(
+    TEST_SHARD_DATABASE_URLS is None,
+    reason="TEST_SHARD_DATABASE_URLS of two scratch databases are not set",
+)
+
+
+def test_hash_ring_moves_users_only_to_added_shard():
+    user_ids = [uuid7() for _ in range(10000)]
+    ring = HashRing(["a", "b", "c"], vnodes=256)
+    grown_ring = HashRing(["a", "b", "c", "d"], vnodes=256)
+    moved = [
+        user_id
+        for user_id in user_ids
+        if ring.shard_for(user_id) != grown_ring.shard_for(user_id)
+    ]
+    assert {grown_ring.shard_for(user_id) for user_id in moved} == {"d"}
+    assert 0.15 < len(moved) / len(user_ids) < 0.35
+    for shard in ["a", "b", "c"]:
+        share = sum(ring.shard_for(user_id) == shard for user_id in user_ids)
+        assert 0.25 < share / len(user_ids) < 0.42
+
+
+@pytest.fixture
+async def shards():
+    """Two scratch shard databases, the test database keeps the directory"""
+    directory = create_async_engine(settings.TEST_DATABASE_URL)
+    engines = {
+        name: create_async_engine(url)
+        for name, url in zip(["a", "b"], TEST_SHARD_DATABASE_URLS.split(","))
+    }
+    for shard_engine in engines.values():
+        async with shard_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+            await connection.execute(
+                text("TRUNCATE TABLE users, user_credentials, refresh_tokens")
+            )
+    yield directory, engines
+    for shard_engine in [directory, *engines.values()]:
+        await shard_engine.dispose()
+
+
+async def _create_users(session_factory, count: int) -> list[User]:
+    async with session_factory() as session:
+        users = [
+            await UserDAL(session).create_user(
+                name="Artem",
+                surname="Budzhak",
+                email=f"Artem{index}@example.com",
+                hashed_password="SampleHashedPass",
+                roles=[PortalRole.ROLE_PORTAL_USER],
+            )
+            for index in range(count)
+        ]
+        await session.commit()
+    return users
+
+
+async def _user_ids_on(shard_engine) -> set:
+    async with shard_engine.connect() as connection:
+        return set((await connection.execute(select(User.user_id))).scalars())
+
+
+@requires_shards
+async def test_sharded_users(shards):
+    directory, engines = shards
+    session_factory = create_sharded_sessionmaker(directory, engines)
+    users = await _create_users(session_factory, 20)
+    ring = HashRing(engines, settings.SHARD_RING_VNODES)
+    for name, shard_engine in engines.items():
+        assert await _user_ids_on(shard_engine) == {
+            user.user_id for user in users if ring.shard_for(user.user_id) == name
+        }
+
+    async with session_factory() as session:
+        user_dal = UserDAL(session)
+        user = await user_dal.get_user_by_email("ARTEM7@example.com")
+        assert user.user_id == users[7].user_id
+        assert (await user_dal.get_user_by_id(users[3].user_id)).email == (
+            "artem3@example.com"
+        )
+        page = await user_dal.list_users(order_by="email", after=None, limit=5)
+        assert [user.email for user in page] == sorted(user.email for user in users)[:5]
+        page = await user_dal.list_users(
+            order_by="user_id", after=users[9].user_id, limit=100
+        )
+        assert [user.user_id for user in page] == [user.user_id for user in users[10:]]
+
+        await user_dal.update_user(users[0].user_id, email="leo@example.com")
+        await session.commit()
+        assert (await user_dal.get_user_by_email("leo@example.com")).user_id == (
+            users[0].user_id
+        )
+        assert await user_dal.get_user_by_email("artem0@example.com") is None
+
+        refresh_token_dal = RefreshTokenDAL(session)
+        await refresh_token_dal.create_refresh_token(
+            user_id=users[5].user_id,
+            token_hash="digest",
+            expires_at=datetime.now(timezone.utc) + timedelta(days=1),
+        )
+        user_row = await refresh_token_dal.rotate_refresh_token("digest")
+        assert user_row.user_id == users[5].user_id
+        assert await refresh_token_dal.rotate_refresh_token("digest") is None
+
+    # Emails are unique across shards
+    async with session_factory() as session:
+        with pytest.raises(IntegrityError):
+            await UserDAL(session).create_user(
+                name="Artem",
+                surname="Budzhak",
+                email="leo@example.com",
+                hashed_password="SampleHashedPass",
+                roles=[PortalRole.ROLE_PORTAL_USER],
+            )
+
+
+@requires_shards
+async def test_rebalance_moves_users_to_added_shard(shards):
+    directory, engines = shards
+    single_shard = {"a": engines["a"]}
+    users = await _create_users(
+        create_sharded_sessionmaker(directory, single_shard), 20
+    )
+    session_factory = create_sharded_sessionmaker(directory, engines)
+    ring = HashRing(engines, settings.SHARD_RING_VNODES)
+    misplaced = [user for user in users if ring.shard_for(user.user_id) == "b"]
+    assert misplaced
+
+    # Not moved yet, found through the directory
+    async with session_factory() as session:
+        user_dal = UserDAL(session)
+        assert await user_dal.get_user_by_id(misplaced[0].user_id) is not None
+        await user_dal.update_password(misplaced[0].user_id, "NewHashedPass")
+        await session.commit()
+
+    # Users of a database sharded the first time are not in the directory
+    async with directory.begin() as connection:
+        await connection.execute(
+            delete(UserShard).where(UserShard.user_id == users[0].user_id)
+        )
+    moved = await rebalance(directory, engines, ring, batch_size=7)
+    assert moved == len(misplaced)
+    assert await _user_ids_on(engines["b"]) == {user.user_id for user in misplaced}
+    async with directory.connect() as connection:
+        res = await connection.execute(select(UserShard.user_id, UserShard.shard))
+        assert dict(res.all()) == {
+            user.user_id: ring.shard_for(user.user_id) for user in users
+        }
+    async with session_factory() as session:
+        _, hashed_password = await UserDAL(session).get_user_with_password_by_email(
+            misplaced[0].email
+        )
+        assert hashed_password == "NewHashedPass"
+    assert await rebalance(directory, engines, ring, batch_size=7) == 0
@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+import pytest
+from jose import JWTError
+
+import cache
+import settings
+from security import create_access_token
+from security import decode_access_token
+from security import get_jwt_backend
+from security import PyJWTBackend
+from security import token_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    token_cache.clear()
+    yield
+    token_cache.clear()
+
+
+def _create_token() -> str:
+    return create_access_token(
+        data={"sub": "user"}, expires_delta=timedelta(minutes=5)
+    )
+
+
+def _token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+async def test_token_cache_entry_expires_with_token(monkeypatch):
+    token = _create_token()
+    payload = decode_access_token(token)
+    # Keyed by digest, the token itself is not kept in memory
+    assert token not in token_cache._entries
+    expires_at, _ = token_cache._entries[_token_digest(token)]
+    assert expires_at == payload["exp"]
+    assert token_cache.get(_token_digest(token)) == payload
+    monkeypatch.setattr(cache.time, "time", lambda: payload["exp"] + 1)
+    assert token_cache.get(_token_digest(token)) is None
+
+
+async def test_token_cache_misses_tampered_token():
+    token = _create_token()
+    assert decode_access_token(token)["sub"] == "user"
+    header, payload, signature = token.split(".")
+    claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    tampered_payload = (
+        base64.urlsafe_b64encode(json.dumps({**claims, "sub": "admin"}).encode())
+        .rstrip(b"=")
+        .decode()
+    )
+    with pytest.raises(JWTError):
+        decode_access_token(f"{header}.{tampered_payload}.{signature}")
+
+
+async def test_token_cache_returns_copies():
+    token = _create_token()
+    decode_access_token(token)["sub"] = "admin"
+    assert decode_access_token(token)["sub"] == "user"
+    decode_access_token(token)["sub"] = "admin"
+    assert decode_access_token(token)["sub"] == "user"
+
+
+async def test_pyjwt_backend_selected_by_setting(monkeypatch):
+    monkeypatch.setattr(settings, "JWT_BACKEND", "pyjwt")
+    assert isinstance(get_jwt_backend(settings.JWT_BACKEND), PyJWTBackend)
+    decoded_tokens = []
+    decode = PyJWTBackend.decode
+
+    def spy_decode(self, token, key, algorithms):
+        decoded_tokens.append(token)
+        return decode(self, token, key, algorithms)
+
+    monkeypatch.setattr(PyJWTBackend, "decode", spy_decode)
+    token = _create_token()
+    payload = decode_access_token(token, use_cache=False)
+    assert decoded_tokens == [token]
+    assert payload["sub"] == "user"
+    assert payload["exp"] > time.time()
@@ -2,6 +2,8 @@ from uuid import uuid4
 
 import pytest
 
+from db.dals import principal_cache
+from db.dals import UserDAL
 from db.models import PortalRole
 from tests.conftest import create_test_auth_headers_for_user
 
@@ -378,7 +380,7 @@ async def test_update_user_duplicate_email_error(client, create_user_in_database
     resp = client.patch(
         f"/user/?user_id={user_data_1['user_id']}",
         json=user_data_updated,
-        headers=create_test_auth_headers_for_user(user_data["user_id"]),
+        headers=create_test_auth_headers_for_user(user_data_1["user_id"]),
     )
     assert resp.status_code == 503
     assert (
@@ -431,6 +433,81 @@ async def test_admin_update_other_admin(
     assert not_updated_user_from_db["user_id"] == user_for_update["user_id"]
 
 
+@pytest.mark.parametrize(
+    "user_for_update_roles, user_who_updates_roles, expected_status_code",
+    [
+        ([PortalRole.ROLE_PORTAL_USER], [PortalRole.ROLE_PORTAL_USER], 403),
+        (
+            [PortalRole.ROLE_PORTAL_USER],
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+            200,
+        ),
+        (
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+            403,
+        ),
+        (
+            [PortalRole.ROLE_PORTAL_USER],
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_SUPERADMIN],
+            406,
+        ),
+        (
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_SUPERADMIN],
+            406,
+        ),
+        (
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_SUPERADMIN],
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_ADMIN],
+            403,
+        ),
+        (
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_SUPERADMIN],
+            [PortalRole.ROLE_PORTAL_USER, PortalRole.ROLE_PORTAL_SUPERADMIN],
+            406,
+        ),
+    ],
+)
+async def test_update_another_user_by_roles(
+    client,
+    create_user_in_database,
+    get_user_from_database,
+    user_for_update_roles,
+    user_who_updates_roles,
+    expected_status_code,
+):
+    user_for_update = {
+        "user_id": uuid4(),
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": "artem@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": user_for_update_roles,
+    }
+    user_who_updates = {
+        "user_id": uuid4(),
+        "name": "Arnold",
+        "surname": "Schwarzenegger",
+        "email": "arnie@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": user_who_updates_roles,
+    }
+    for user_data in [user_for_update, user_who_updates]:
+        await create_user_in_database(**user_data)
+    resp = client.patch(
+        f"/user/?user_id={user_for_update['user_id']}",
+        json={"name": "Leo", "surname": "Vinci", "email": "leo@example.com"},
+        headers=create_test_auth_headers_for_user(user_who_updates["user_id"]),
+    )
+    assert resp.status_code == expected_status_code
+    user_from_db = dict((await get_user_from_database(user_for_update["user_id"]))[0])
+    expected_name = "Leo" if expected_status_code == 200 else "Artem"
+    assert user_from_db["name"] == expected_name
+
+
 async def _patch_and_validate_user(
     client, user_data: dict, user_data_updated, get_user_from_database
 ):
@@ -449,3 +526,28 @@ async def _patch_and_validate_user(
     assert user_from_db["email"] == user_data_updated["email"]
     assert user_from_db["is_active"] is user_data["is_active"]
     assert user_from_db["user_id"] == user_data["user_id"]
+
+
+async def test_update_user_invalidates_cached_principal_on_commit(
+    async_session_test, create_user_in_database
+):
+    user_data = {
+        "user_id": uuid4(),
+        "name": "Artem",
+        "surname": "Budzhak",
+        "email": "artem@example.com",
+        "is_active": True,
+        "hashed_password": "SampleHashedPass",
+        "roles": [PortalRole.ROLE_PORTAL_USER],
+    }
+    await create_user_in_database(**user_data)
+    async with async_session_test() as session:
+        user_dal = UserDAL(session)
+        principal_cache.set(
+            user_data["user_id"], await user_dal.get_user_by_id(user_data["user_id"])
+        )
+        assert await user_dal.update_user(user_data["user_id"], name="Leo")
+        # Other requests still read the previous row until the commit
+        assert principal_cache.get(user_data["user_id"]).name == "Artem"
+        await session.commit()
+    assert principal_cache.get(user_data["user_id"]) is None